@@ -71,10 +71,17 @@ async function main() {
   console.log('Creating tables...');
 
   sqlite.exec(`
+    DROP TABLE IF EXISTS host_rankings;
+    DROP TABLE IF EXISTS gene_codon_matrix;
+    DROP TABLE IF EXISTS adaptation_profiles;
     DROP TABLE IF EXISTS codon_adaptation;
+    DROP TABLE IF EXISTS host_codon_weights;
+    DROP TABLE IF EXISTS host_trna_hosts;
     DROP TABLE IF EXISTS host_trna_pools;
     DROP TABLE IF EXISTS defense_systems;
     DROP TABLE IF EXISTS amg_annotations;
+    DROP TABLE IF EXISTS gene_annotation_status;
+    DROP TABLE IF EXISTS interpro_jobs;
     DROP TABLE IF EXISTS protein_domains;
     DROP TABLE IF EXISTS annotation_meta;
     DROP TABLE IF EXISTS preferences;
@@ -199,7 +206,8 @@ async function main() {
       end INTEGER,
       score REAL,
       e_value REAL,
-      description TEXT
+      description TEXT,
+      interpro_id TEXT
     );
     CREATE INDEX idx_domains_phage ON protein_domains(phage_id);
     CREATE INDEX idx_domains_gene ON protein_domains(gene_id);
@@ -220,6 +228,7 @@ async function main() {
     );
     CREATE INDEX idx_amg_phage ON amg_annotations(phage_id);
     CREATE INDEX idx_amg_type ON amg_annotations(amg_type);
+    CREATE UNIQUE INDEX uniq_amg_gene_ko ON amg_annotations(phage_id, gene_id, kegg_ortholog);
 
     CREATE TABLE defense_systems (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -262,6 +271,29 @@ async function main() {
     );
     CREATE INDEX idx_adaptation_phage ON codon_adaptation(phage_id);
     CREATE INDEX idx_adaptation_host ON codon_adaptation(host_name);
+
+    CREATE TABLE adaptation_profiles (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      phage_id INTEGER NOT NULL REFERENCES phages(id),
+      host_name TEXT NOT NULL,
+      metric TEXT NOT NULL,
+      window_bp INTEGER NOT NULL,
+      step_bp INTEGER NOT NULL,
+      points INTEGER NOT NULL,
+      profile BLOB NOT NULL,
+      created_at INTEGER
+    );
+    CREATE UNIQUE INDEX uniq_profile_phage_host_metric ON adaptation_profiles(phage_id, host_name, metric);
+
+    CREATE TABLE host_rankings (
+      phage_id INTEGER NOT NULL REFERENCES phages(id),
+      metric TEXT NOT NULL,
+      rank INTEGER NOT NULL,
+      host_name TEXT NOT NULL,
+      score REAL NOT NULL,
+      created_at INTEGER,
+      PRIMARY KEY (phage_id, metric, rank)
+    );
   `);
 
   console.log('Tables created.\n');
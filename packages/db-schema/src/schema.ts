@@ -1,4 +1,4 @@
-import { sqliteTable, text, integer, real, blob, index, uniqueIndex } from 'drizzle-orm/sqlite-core';
+import { sqliteTable, text, integer, real, blob, index, uniqueIndex, primaryKey } from 'drizzle-orm/sqlite-core';
 
 // Main phages catalog table
 export const phages = sqliteTable('phages', {
@@ -125,6 +125,7 @@ export const proteinDomains = sqliteTable('protein_domains', {
   score: real('score'),
   eValue: real('e_value'),
   description: text('description'),
+  interproId: text('interpro_id'), // InterPro entry the signature belongs to, e.g. "IPR001650"
 }, (table) => [
   index('idx_domains_phage').on(table.phageId),
   index('idx_domains_gene').on(table.geneId),
@@ -147,6 +148,7 @@ export const amgAnnotations = sqliteTable('amg_annotations', {
 }, (table) => [
   index('idx_amg_phage').on(table.phageId),
   index('idx_amg_type').on(table.amgType),
+  uniqueIndex('uniq_amg_gene_ko').on(table.phageId, table.geneId, table.keggOrtholog),
 ]);
 
 // Phage defense/counter-defense systems
@@ -188,7 +190,7 @@ export const codonAdaptation = sqliteTable('codon_adaptation', {
   hostName: text('host_name').notNull(),
   geneId: integer('gene_id').references(() => genes.id), // NULL for whole-genome
   locusTag: text('locus_tag'),
-  cai: real('cai'), // Codon Adaptation Index
+  cai: real('cai'), // Codon Adaptation Index; NULL: host_trna_pools has no highly expressed reference genes
   tai: real('tai'), // tRNA Adaptation Index
   cpb: real('cpb'), // Codon Pair Bias
   encPrime: real('enc_prime'), // Nc' (expected Nc given GC)
@@ -197,6 +199,33 @@ export const codonAdaptation = sqliteTable('codon_adaptation', {
   index('idx_adaptation_host').on(table.hostName),
 ]);
 
+// Sliding-window tAI along each genome, per phage-host pair
+export const adaptationProfiles = sqliteTable('adaptation_profiles', {
+  id: integer('id').primaryKey({ autoIncrement: true }),
+  phageId: integer('phage_id').notNull().references(() => phages.id),
+  hostName: text('host_name').notNull(),
+  metric: text('metric').notNull(), // tai, tai_family (tRNA weights relative to the synonymous family)
+  windowBp: integer('window_bp').notNull(),
+  stepBp: integer('step_bp').notNull(), // value i is centred on genome position i * stepBp
+  points: integer('points').notNull(),
+  profile: blob('profile').notNull(), // Float32Array bytes (little-endian), NaN = too few codons
+  createdAt: integer('created_at'), // unix timestamp
+}, (table) => [
+  uniqueIndex('uniq_profile_phage_host_metric').on(table.phageId, table.hostName, table.metric),
+]);
+
+// Best-adapted hosts per phage, by whole-genome codon adaptation
+export const hostRankings = sqliteTable('host_rankings', {
+  phageId: integer('phage_id').notNull().references(() => phages.id),
+  metric: text('metric').notNull(), // tai, tai_family (tRNA weights relative to the synonymous family)
+  rank: integer('rank').notNull(), // 1 = best adapted
+  hostName: text('host_name').notNull(),
+  score: real('score').notNull(),
+  createdAt: integer('created_at'), // unix timestamp
+}, (table) => [
+  primaryKey({ columns: [table.phageId, table.metric, table.rank] }),
+]);
+
 // Annotation metadata (tracks when annotations were last updated)
 export const annotationMeta = sqliteTable('annotation_meta', {
   key: text('key').primaryKey(),
@@ -245,5 +274,11 @@ export type NewHostTrnaPool = typeof hostTrnaPools.$inferInsert;
 export type CodonAdaptation = typeof codonAdaptation.$inferSelect;
 export type NewCodonAdaptation = typeof codonAdaptation.$inferInsert;
 
+export type AdaptationProfile = typeof adaptationProfiles.$inferSelect;
+export type NewAdaptationProfile = typeof adaptationProfiles.$inferInsert;
+
+export type HostRanking = typeof hostRankings.$inferSelect;
+export type NewHostRanking = typeof hostRankings.$inferInsert;
+
 export type AnnotationMeta = typeof annotationMeta.$inferSelect;
 export type NewAnnotationMeta = typeof annotationMeta.$inferInsert;
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Sliding-Window Translational Adaptation Profiles
+
+For every phage x host, computes tAI and family-relative tAI (see
+codon_adaptation.py) in a window slid along the genome, to show where
+codon usage shifts toward or away from a host (horizontally acquired
+modules, early vs. late genes).
+
+Every CDS codon is placed at its genomic position and given its log
+weight for each host. Prefix sums over those weights and over the codon
+counts give any window's geometric mean as one difference, so a profile
+costs O(genome length) whatever the window size.
+
+Profiles are downsampled to at most --points values and stored in
+adaptation_profiles as little-endian float32 blobs (NaN where a window
+holds too few codons), one row per phage, host and metric. Value i is
+the window centred on genome position i * step_bp.
+
+Usage:
+    python codon_matrix.py --db phage.db
+    python adaptation_profiles.py --db phage.db [--window 3000] [--points 500]
+"""
+
+import argparse
+import math
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from codon_adaptation import FAMILY_CODONS, TAI_CODONS, relative_weights
+from codon_matrix import iter_codon_matrices
+from db_writer import BatchWriter
+from host_trna_data import ensure_tables, load_scoring_inputs
+from pipeline_context import PipelineContext, connect
+
+DEFAULT_WINDOW = 3000  # bp
+DEFAULT_POINTS = 500
+MIN_WINDOW_CODONS = 30
+# Hosts per prefix-sum block; each block holds BLOCK_HOSTS x codons floats
+BLOCK_HOSTS = 64
+
+INSERT_PROFILE_SQL = """
+    INSERT INTO adaptation_profiles
+    (phage_id, host_name, metric, window_bp, step_bp, points, profile, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def ensure_profile_table(conn: sqlite3.Connection):
+    """Create the adaptation_profiles table if it does not exist."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS adaptation_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phage_id INTEGER NOT NULL,
+            host_name TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            window_bp INTEGER NOT NULL,
+            step_bp INTEGER NOT NULL,
+            points INTEGER NOT NULL,
+            profile BLOB NOT NULL,
+            created_at INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uniq_profile_phage_host_metric
+        ON adaptation_profiles(phage_id, host_name, metric)
+    """)
+    conn.commit()
+
+
+def codon_positions(genes: list[tuple[int, int, str]], lengths: np.ndarray) -> np.ndarray:
+    """Genome position (0-based, first base) of every codon of the concatenated gene streams."""
+    positions = []
+    for (start_pos, end_pos, strand), n in zip(genes, lengths):
+        steps = 3 * np.arange(n)
+        if strand == '-':
+            positions.append(end_pos - 3 - steps)
+        else:
+            positions.append(start_pos - 1 + steps)
+    return np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+
+
+def window_profiles(
+    positions: np.ndarray,
+    codons: np.ndarray,
+    log_weights: np.ndarray,
+    mask: np.ndarray,
+    centers: np.ndarray,
+    window: int,
+) -> np.ndarray:
+    """Hosts x windows geometric mean weight of the codons in each window.
+
+    positions must be sorted; mask selects the codons the index counts.
+    Hosts are processed BLOCK_HOSTS at a time to bound memory on long
+    genomes.
+    """
+    # Column 64 takes ambiguous codons, which no index counts
+    log_weights = np.pad(log_weights, ((0, 0), (0, 1)))
+    used = np.append(mask, False)[codons]
+    cum_count = np.concatenate([[0], np.cumsum(used)])
+
+    lo = np.searchsorted(positions, centers - window / 2, side='left')
+    hi = np.searchsorted(positions, centers + window / 2, side='left')
+    n = cum_count[hi] - cum_count[lo]
+
+    values = np.empty((len(log_weights), len(centers)))
+    # Prefix sums with a leading zero, so window [lo, hi) sums to cum[hi] - cum[lo]
+    cum_log = np.zeros((min(BLOCK_HOSTS, len(log_weights)), len(codons) + 1))
+    for block in range(0, len(log_weights), BLOCK_HOSTS):
+        block_weights = log_weights[block:block + BLOCK_HOSTS]
+        cum = cum_log[:len(block_weights)]
+        np.cumsum(block_weights[:, codons] * used, axis=1, out=cum[:, 1:])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values[block:block + len(block_weights)] = np.exp((cum[:, hi] - cum[:, lo]) / n)
+    values[:, n < MIN_WINDOW_CODONS] = np.nan
+    return values
+
+
+def compute_profiles(db_path: str, window: int = DEFAULT_WINDOW, points: int = DEFAULT_POINTS,
+                     ctx: PipelineContext | None = None):
+    """Recompute tAI and family-relative tAI profiles of every phage against every host."""
+    writer = BatchWriter(db_path)
+    conn = connect(db_path, ctx)
+    ensure_profile_table(conn)
+
+    inputs = load_scoring_inputs(writer, conn)
+    if inputs is None:
+        conn.close()
+        writer.close()
+        return
+    phage_count, hosts, weights = inputs
+
+    log_tai, log_family = relative_weights(weights)
+    metrics = {'tai': (log_tai, TAI_CODONS), 'tai_family': (log_family, FAMILY_CODONS)}
+    coords = {
+        row[0]: (row[1], row[2], row[3])
+        for row in conn.execute("SELECT id, start_pos, end_pos, strand FROM genes WHERE type = 'CDS'")
+    }
+
+    profile_count = 0
+    for matrix in tqdm(iter_codon_matrices(conn), total=phage_count, desc="Adaptation profiles"):
+        genome_length = conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(sequence)), 0) FROM sequences WHERE phage_id = ?", (matrix.phage_id,)
+        ).fetchone()[0]
+        writer.add("DELETE FROM adaptation_profiles WHERE phage_id = ?", (matrix.phage_id,))
+        if not genome_length or not len(matrix.codons):
+            continue
+
+        positions = codon_positions(
+            [coords[gene_id] for gene_id in matrix.gene_ids.tolist()], np.diff(matrix.offsets)
+        )
+        order = np.argsort(positions, kind='stable')
+        positions = positions[order]
+        codons = matrix.codons[order].astype(np.intp)
+
+        step = max(1, math.ceil(genome_length / points))
+        centers = np.arange(0, genome_length, step)
+
+        now = int(time.time())
+        for metric, (log_weights, mask) in metrics.items():
+            values = window_profiles(positions, codons, log_weights, mask, centers, window)
+            writer.add_many(INSERT_PROFILE_SQL, (
+                (matrix.phage_id, host, metric, window, step, len(centers),
+                 values[h].astype('<f4').tobytes(), now)
+                for h, host in enumerate(hosts)
+            ))
+            profile_count += len(hosts)
+
+    conn.close()
+
+    writer.add("""
+        INSERT OR REPLACE INTO annotation_meta (key, value, updated_at)
+        VALUES ('adaptation_profiles_updated', ?, ?)
+    """, (f"{profile_count} profiles, {window} bp window", int(time.time())))
+    writer.close()
+
+    print(f"Stored {profile_count} profiles ({len(hosts)} hosts, {window} bp window)")
+
+
+def main(argv: list[str] | None = None, ctx: PipelineContext | None = None):
+    parser = argparse.ArgumentParser(description="Compute sliding-window tAI profiles along phage genomes")
+    parser.add_argument("--db", required=True, help="Path to phage.db")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="Window size in bp")
+    parser.add_argument("--points", type=int, default=DEFAULT_POINTS,
+                        help="Maximum number of values stored per profile")
+    args = parser.parse_args(argv)
+
+    db_path = Path(args.db)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        return 1
+
+    ensure_tables(str(db_path))
+    compute_profiles(str(db_path), args.window, args.points, ctx)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,74 +1,114 @@
 #!/usr/bin/env python3
 """
-Protein Domain Annotation via InterProScan REST API
+Protein Domain Annotation via InterProScan
 
-Submits phage protein sequences to EBI's InterProScan service
-and stores domain annotations in SQLite.
+Runs phage protein sequences through InterProScan and stores domain
+annotations in SQLite. By default proteins go to EBI's REST service
+concurrently (bounded by a jobs-in-flight ceiling); with --backend local
+they are batched through a locally installed interproscan.sh instead.
+Output files from an earlier InterProScan run can also be imported
+directly with --import-results.
 
 Usage:
     python annotate_domains.py --db phage.db [--force]
+    python annotate_domains.py --db phage.db --backend local [--interproscan PATH]
+    python annotate_domains.py --db phage.db --import-results results/*.tsv
 """
 
 import argparse
-import json
+import asyncio
+import hashlib
 import sqlite3
+import tempfile
 import time
+from collections import defaultdict
+from itertools import islice
 from pathlib import Path
-from typing import Iterator
+from typing import Callable, Iterable, Iterator
 
-import requests
 from tqdm import tqdm
 
-# InterProScan REST API endpoints
-INTERPRO_SUBMIT = "https://www.ebi.ac.uk/Tools/services/rest/iprscan5/run"
-INTERPRO_STATUS = "https://www.ebi.ac.uk/Tools/services/rest/iprscan5/status/{job_id}"
-INTERPRO_RESULT = "https://www.ebi.ac.uk/Tools/services/rest/iprscan5/result/{job_id}/json"
-
-# Rate limiting
-REQUEST_DELAY = 1.0  # seconds between API calls
-MAX_RETRIES = 3
-POLL_INTERVAL = 30  # seconds between status checks
-
-
-def translate_sequence(seq: str, frame: int = 0) -> str:
-    """Translate DNA to protein sequence."""
-    codon_table = {
-        'TTT': 'F', 'TTC': 'F', 'TTA': 'L', 'TTG': 'L',
-        'TCT': 'S', 'TCC': 'S', 'TCA': 'S', 'TCG': 'S',
-        'TAT': 'Y', 'TAC': 'Y', 'TAA': '*', 'TAG': '*',
-        'TGT': 'C', 'TGC': 'C', 'TGA': '*', 'TGG': 'W',
-        'CTT': 'L', 'CTC': 'L', 'CTA': 'L', 'CTG': 'L',
-        'CCT': 'P', 'CCC': 'P', 'CCA': 'P', 'CCG': 'P',
-        'CAT': 'H', 'CAC': 'H', 'CAA': 'Q', 'CAG': 'Q',
-        'CGT': 'R', 'CGC': 'R', 'CGA': 'R', 'CGG': 'R',
-        'ATT': 'I', 'ATC': 'I', 'ATA': 'I', 'ATG': 'M',
-        'ACT': 'T', 'ACC': 'T', 'ACA': 'T', 'ACG': 'T',
-        'AAT': 'N', 'AAC': 'N', 'AAA': 'K', 'AAG': 'K',
-        'AGT': 'S', 'AGC': 'S', 'AGA': 'R', 'AGG': 'R',
-        'GTT': 'V', 'GTC': 'V', 'GTA': 'V', 'GTG': 'V',
-        'GCT': 'A', 'GCC': 'A', 'GCA': 'A', 'GCG': 'A',
-        'GAT': 'D', 'GAC': 'D', 'GAA': 'E', 'GAG': 'E',
-        'GGT': 'G', 'GGC': 'G', 'GGA': 'G', 'GGG': 'G',
-    }
-
-    protein = []
-    seq = seq.upper()[frame:]
-    for i in range(0, len(seq) - 2, 3):
-        codon = seq[i:i+3]
-        aa = codon_table.get(codon, 'X')
-        if aa == '*':
-            break
-        protein.append(aa)
-    return ''.join(protein)
-
-
-def get_gene_proteins(db_path: str) -> Iterator[dict]:
-    """Extract CDS genes and their protein sequences from the database."""
+from db_writer import DEFAULT_FLUSH_INTERVAL, DEFAULT_FLUSH_SIZE, BatchWriter
+from interpro_backends import (
+    DEFAULT_INTERPROSCAN,
+    DEFAULT_LOCAL_CPU,
+    DEFAULT_LOCAL_WORKERS,
+    DEFAULT_SHARD_SIZE,
+    MAX_CONCURRENT_REQUESTS,
+    MAX_JOBS_IN_FLIGHT,
+    InterProBackend,
+    LocalBackend,
+    RemoteBackend,
+    iter_result_file,
+    parse_interpro_result,
+    result_query_id,
+)
+from interpro_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_MB, InterProCache, protein_hash
+from pipeline_context import PipelineContext, read_genome, run_coroutine
+from sequence_utils import translate_genes
+
+# Runs in which a gene may fail before it is no longer retried
+MAX_FAILED_RUNS = 3
+
+MIN_PROTEIN_LENGTH = 30  # Minimum length for InterProScan
+
+
+# CDS genes that are new, whose coordinates changed, whose failed
+# annotation is still eligible for a retry, or that are marked annotated
+# but whose domains are gone (protein_domains was dropped by a rebuild)
+PENDING_GENES_FILTER = f"""
+    AND NOT EXISTS (
+        SELECT 1 FROM gene_annotation_status s
+        WHERE s.gene_id = g.id
+          AND s.start_pos = g.start_pos AND s.end_pos = g.end_pos AND s.strand IS g.strand
+          AND (s.status != 'failed' OR s.retry_count >= {MAX_FAILED_RUNS})
+          AND (s.status != 'annotated' OR EXISTS (SELECT 1 FROM protein_domains pd WHERE pd.gene_id = g.id))
+    )
+"""
+
+
+def count_cds_genes(db_path: str, skip_annotated: bool = False) -> int:
+    """Count CDS genes that get_gene_proteins() would consider."""
     conn = sqlite3.connect(db_path)
+    query = "SELECT COUNT(*) FROM genes g WHERE g.type = 'CDS'"
+    if skip_annotated:
+        query += PENDING_GENES_FILTER
+    count = conn.execute(query).fetchone()[0]
+    conn.close()
+    return count
+
+
+def get_gene_proteins(
+    db_path: str,
+    skip_annotated: bool = False,
+    on_too_short: Callable[[dict], None] | None = None,
+    ctx: PipelineContext | None = None,
+) -> Iterator[dict]:
+    """Stream CDS genes and their protein sequences from the database.
+
+    Genes come out phage by phage; only the current phage's genome is held
+    in memory (or taken from the context's genome cache). With
+    skip_annotated, genes settled in gene_annotation_status are filtered
+    out in SQL before any genome is loaded. Genes whose protein is too
+    short for InterProScan are passed to on_too_short instead.
+    """
+    # Consumed on the shared event loop thread when run in-process, but
+    # closed by the step that created the stream
+    conn = sqlite3.connect(db_path, check_same_thread=False)
     conn.row_factory = sqlite3.Row
 
-    # Get all CDS genes with their sequences
-    query = """
+    pending_filter = PENDING_GENES_FILTER if skip_annotated else ""
+
+    phage_ids = [
+        row[0] for row in conn.execute(f"""
+            SELECT DISTINCT g.phage_id FROM genes g
+            WHERE g.type = 'CDS' {pending_filter}
+            ORDER BY g.phage_id
+        """)
+    ]
+
+    # Get one phage's CDS genes in genome order
+    query = f"""
         SELECT
             g.id as gene_id,
             g.phage_id,
@@ -82,120 +122,46 @@ def get_gene_proteins(db_path: str) -> Iterator[dict]:
             p.name as phage_name
         FROM genes g
         JOIN phages p ON g.phage_id = p.id
-        WHERE g.type = 'CDS'
-        ORDER BY g.phage_id, g.start_pos
+        WHERE g.type = 'CDS' AND g.phage_id = ?
+        {pending_filter}
+        ORDER BY g.start_pos
     """
 
-    cursor = conn.execute(query)
-
-    # We need to reconstruct sequences from chunks
-    seq_cache = {}
-
-    for row in cursor:
-        phage_id = row['phage_id']
-
-        # Get full sequence if not cached
-        if phage_id not in seq_cache:
-            seq_query = "SELECT sequence FROM sequences WHERE phage_id = ? ORDER BY chunk_index"
-            chunks = conn.execute(seq_query, (phage_id,)).fetchall()
-            seq_cache[phage_id] = ''.join(c['sequence'] for c in chunks)
-
-        full_seq = seq_cache[phage_id]
-
-        # Extract gene DNA sequence
-        start = row['start_pos'] - 1  # 1-based to 0-based
-        end = row['end_pos']
-        gene_seq = full_seq[start:end]
-
-        # Handle reverse strand
-        if row['strand'] == '-':
-            complement = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
-            gene_seq = ''.join(complement.get(c, 'N') for c in reversed(gene_seq))
-
-        # Translate to protein
-        protein_seq = translate_sequence(gene_seq)
-
-        if len(protein_seq) >= 30:  # Minimum length for InterProScan
-            yield {
-                'gene_id': row['gene_id'],
-                'phage_id': phage_id,
-                'locus_tag': row['locus_tag'] or f"gene_{row['gene_id']}",
-                'product': row['product'],
-                'protein_seq': protein_seq,
-                'phage_name': row['phage_name'],
-            }
-
-    conn.close()
-
-
-def submit_interpro_job(sequence: str, email: str = "phage-explorer@example.com") -> str:
-    """Submit a sequence to InterProScan and return job ID."""
-    data = {
-        'email': email,
-        'sequence': sequence,
-        'goterms': 'false',
-        'pathways': 'false',
-    }
-
-    for attempt in range(MAX_RETRIES):
-        try:
-            resp = requests.post(INTERPRO_SUBMIT, data=data, timeout=60)
-            resp.raise_for_status()
-            return resp.text.strip()
-        except requests.RequestException as e:
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(REQUEST_DELAY * (attempt + 1))
-            else:
-                raise RuntimeError(f"Failed to submit job: {e}")
-
-    return ""
-
-
-def check_job_status(job_id: str) -> str:
-    """Check InterProScan job status."""
-    url = INTERPRO_STATUS.format(job_id=job_id)
-    resp = requests.get(url, timeout=30)
-    resp.raise_for_status()
-    return resp.text.strip()
-
-
-def get_job_result(job_id: str) -> dict:
-    """Get InterProScan results as JSON."""
-    url = INTERPRO_RESULT.format(job_id=job_id)
-    resp = requests.get(url, timeout=60)
-    resp.raise_for_status()
-    return resp.json()
-
-
-def parse_interpro_result(result: dict) -> list[dict]:
-    """Parse InterProScan JSON result into domain records."""
-    domains = []
-
-    for seq_result in result.get('results', []):
-        for match in seq_result.get('matches', []):
-            signature = match.get('signature', {})
-            entry = signature.get('entry', {})
-
-            for location in match.get('locations', []):
-                domain = {
-                    'domain_id': signature.get('accession', ''),
-                    'domain_name': signature.get('name', ''),
-                    'domain_type': signature.get('signatureLibraryRelease', {}).get('library', ''),
-                    'start': location.get('start', 0),
-                    'end': location.get('end', 0),
-                    'score': location.get('score', 0.0),
-                    'e_value': location.get('evalue', 1.0),
-                    'description': entry.get('description', signature.get('description', '')),
+    # Translate each phage's genes in one batch over its reconstructed genome.
+    # Every query is fully fetched before yielding so no read lock is held
+    # while the consumer writes results.
+    try:
+        for phage_id in phage_ids:
+            rows = conn.execute(query, (phage_id,)).fetchall()
+
+            full_seq = ctx.genome(phage_id) if ctx else read_genome(conn, phage_id)
+
+            proteins = translate_genes(
+                full_seq,
+                [(row['start_pos'], row['end_pos'], row['strand']) for row in rows],
+            )
+            del full_seq
+
+            for row, protein_seq in zip(rows, proteins):
+                gene = {
+                    'gene_id': row['gene_id'],
+                    'phage_id': phage_id,
+                    'locus_tag': row['locus_tag'] or f"gene_{row['gene_id']}",
+                    'product': row['product'],
+                    'protein_seq': protein_seq,
+                    'protein_hash': protein_hash(protein_seq),
+                    'phage_name': row['phage_name'],
+                    'start_pos': row['start_pos'],
+                    'end_pos': row['end_pos'],
+                    'strand': row['strand'],
                 }
-
-                # Add InterPro entry if available
-                if entry:
-                    domain['interpro_id'] = entry.get('accession', '')
-                    domain['interpro_name'] = entry.get('name', '')
-
-                domains.append(domain)
-
-    return domains
+                if len(protein_seq) >= MIN_PROTEIN_LENGTH:
+                    yield gene
+                elif on_too_short:
+                    on_too_short(gene)
+    finally:
+        # Also runs when the consumer stops early (e.g. --limit)
+        conn.close()
 
 
 def ensure_tables(db_path: str):
@@ -215,10 +181,16 @@ def ensure_tables(db_path: str):
             end INTEGER,
             score REAL,
             e_value REAL,
-            description TEXT
+            description TEXT,
+            interpro_id TEXT
         )
     """)
 
+    # Tables created before InterPro entries were kept lack interpro_id
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(protein_domains)")}
+    if 'interpro_id' not in columns:
+        conn.execute("ALTER TABLE protein_domains ADD COLUMN interpro_id TEXT")
+
     conn.execute("CREATE INDEX IF NOT EXISTS idx_domains_phage ON protein_domains(phage_id)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_domains_gene ON protein_domains(gene_id)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_domains_domain ON protein_domains(domain_id)")
@@ -231,21 +203,64 @@ def ensure_tables(db_path: str):
         )
     """)
 
+    # Journal of remote jobs, so a killed run can resume instead of resubmitting
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS interpro_jobs (
+            job_id TEXT PRIMARY KEY,
+            protein_hash TEXT NOT NULL,
+            submitted_at INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            updated_at INTEGER,
+            protein_length INTEGER
+        )
+    """)
+
+    # Journals created before run times were modelled lack protein_length
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(interpro_jobs)")}
+    if 'protein_length' not in columns:
+        conn.execute("ALTER TABLE interpro_jobs ADD COLUMN protein_length INTEGER")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_interpro_jobs_status ON interpro_jobs(status)")
+
+    # Per-gene outcome of the last annotation attempt, for incremental runs
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS gene_annotation_status (
+            gene_id INTEGER PRIMARY KEY,
+            protein_hash TEXT,
+            status TEXT NOT NULL,
+            retry_count INTEGER NOT NULL DEFAULT 0,
+            start_pos INTEGER,
+            end_pos INTEGER,
+            strand TEXT,
+            updated_at INTEGER
+        )
+    """)
+
+    # Genes annotated before the status table existed count as annotated
+    conn.execute("""
+        INSERT OR IGNORE INTO gene_annotation_status
+        (gene_id, protein_hash, status, retry_count, start_pos, end_pos, strand, updated_at)
+        SELECT g.id, NULL, 'annotated', 0, g.start_pos, g.end_pos, g.strand, ?
+        FROM genes g
+        WHERE EXISTS (SELECT 1 FROM protein_domains pd WHERE pd.gene_id = g.id)
+    """, (int(time.time()),))
+
     conn.commit()
     conn.close()
 
 
-def insert_domains(db_path: str, gene_id: int, phage_id: int, locus_tag: str, domains: list[dict]):
-    """Insert domain annotations into the database."""
-    conn = sqlite3.connect(db_path)
+INSERT_DOMAIN_SQL = """
+    INSERT INTO protein_domains
+    (phage_id, gene_id, locus_tag, domain_id, domain_name, domain_type,
+     start, end, score, e_value, description, interpro_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
 
-    for domain in domains:
-        conn.execute("""
-            INSERT INTO protein_domains
-            (phage_id, gene_id, locus_tag, domain_id, domain_name, domain_type,
-             start, end, score, e_value, description)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+def insert_domains(writer: BatchWriter, gene_id: int, phage_id: int, locus_tag: str, domains: list[dict]):
+    """Queue domain annotations for one gene on the batch writer."""
+    writer.add_many(INSERT_DOMAIN_SQL, (
+        (
             phage_id,
             gene_id,
             locus_tag,
@@ -257,19 +272,335 @@ def insert_domains(db_path: str, gene_id: int, phage_id: int, locus_tag: str, do
             domain['score'],
             domain['e_value'],
             domain['description'],
-        ))
+            domain.get('interpro_id') or None,
+        )
+        for domain in domains
+    ))
+
+
+def insert_missing_domains(writer: BatchWriter, gene: dict, domains: list[dict]):
+    """Queue only the domains a gene does not already have at the same position."""
+    writer.add_many("""
+        INSERT INTO protein_domains
+        (phage_id, gene_id, locus_tag, domain_id, domain_name, domain_type,
+         start, end, score, e_value, description, interpro_id)
+        SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM protein_domains
+            WHERE gene_id = ? AND domain_id = ? AND start IS ? AND end IS ?
+        )
+    """, (
+        (
+            gene['phage_id'],
+            gene['gene_id'],
+            gene['locus_tag'],
+            domain['domain_id'],
+            domain['domain_name'],
+            domain['domain_type'],
+            domain['start'],
+            domain['end'],
+            domain['score'],
+            domain['e_value'],
+            domain['description'],
+            domain.get('interpro_id') or None,
+            gene['gene_id'],
+            domain['domain_id'],
+            domain['start'],
+            domain['end'],
+        )
+        for domain in domains
+    ))
 
-    conn.commit()
-    conn.close()
 
+def record_gene_status(writer: BatchWriter, gene: dict, status: str):
+    """Record the outcome of annotating a gene.
 
-def main():
+    status is one of 'annotated', 'no_hits', 'failed' or 'too_short'.
+    Repeated failures of the same protein increment retry_count.
+    """
+    writer.add("""
+        INSERT INTO gene_annotation_status
+        (gene_id, protein_hash, status, retry_count, start_pos, end_pos, strand, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(gene_id) DO UPDATE SET
+            retry_count = CASE
+                WHEN excluded.status = 'failed' AND status = 'failed'
+                     AND protein_hash IS excluded.protein_hash
+                THEN retry_count + 1
+                ELSE excluded.retry_count
+            END,
+            protein_hash = excluded.protein_hash,
+            status = excluded.status,
+            start_pos = excluded.start_pos,
+            end_pos = excluded.end_pos,
+            strand = excluded.strand,
+            updated_at = excluded.updated_at
+    """, (
+        gene['gene_id'],
+        gene['protein_hash'],
+        status,
+        1 if status == 'failed' else 0,
+        gene['start_pos'],
+        gene['end_pos'],
+        gene['strand'],
+        int(time.time()),
+    ))
+
+
+def record_gene_domains(writer: BatchWriter, gene: dict, domains: list[dict]):
+    """Replace a gene's domains and mark it annotated (or no_hits)."""
+    writer.add("DELETE FROM protein_domains WHERE gene_id = ?", (gene['gene_id'],))
+    insert_domains(writer, gene['gene_id'], gene['phage_id'], gene['locus_tag'], domains)
+    record_gene_status(writer, gene, 'annotated' if domains else 'no_hits')
+
+
+def insert_group_domains(writer: BatchWriter, group: dict, domains: list[dict]):
+    """Queue one protein's domains for every gene that encodes it."""
+    for gene in group['genes']:
+        record_gene_domains(writer, gene, domains)
+
+
+def describe_group(group: dict) -> str:
+    """Label a protein group by its first gene's locus tag."""
+    label = group['genes'][0]['locus_tag']
+    if len(group['genes']) > 1:
+        label += f" (+{len(group['genes']) - 1} identical)"
+    return label
+
+
+async def run_jobs(
+    writer: BatchWriter,
+    genes: Iterable[dict],
+    backend: InterProBackend,
+    cache: InterProCache | None = None,
+    expected_total: int | None = None,
+) -> tuple[int, int]:
+    """Annotate a stream of genes, keeping at most backend.max_in_flight proteins in flight.
+
+    Genes are pulled from the iterator only when a slot is free, so memory
+    stays bounded by the in-flight window. Each unique protein is annotated
+    once: a gene whose protein is already in flight joins that protein's
+    group, and one whose protein has finished is served from the cache.
+    With expected_total (the number of genes the stream is expected to
+    yield) the progress bar shows an ETA for the whole batch. Returns
+    (completed, failed) gene counts.
+    """
+    slots = asyncio.Semaphore(backend.max_in_flight)
+    progress = tqdm(desc="Annotating", unit="gene")
+    pending: dict[str, dict] = {}  # protein_seq -> group in flight
+    completed = 0
+    failed = 0
+    gene_count = 0
+    protein_count = 0
+    job_count = 0
+
+    def batch_eta() -> float:
+        """Seconds until the in-flight proteins and the rest of the stream are done."""
+        remaining_jobs = 0.0
+        if expected_total and gene_count:
+            # Assume the rest of the stream needs jobs at the rate seen so far
+            remaining_jobs = max(expected_total - gene_count, 0) * job_count / gene_count
+        waves = remaining_jobs / backend.max_in_flight
+        return backend.remaining_seconds() + waves * backend.expected_seconds()
+
+    async def process(group: dict):
+        nonlocal completed, failed
+        try:
+            status, domains, version, job_id = await backend.annotate(group)
+            # The job's terminal status goes last and in the same transaction,
+            # so a journaled FINISHED job always has its domains stored
+            with writer.hold():
+                if domains is None:
+                    for gene in group['genes']:
+                        record_gene_status(writer, gene, 'failed')
+                else:
+                    insert_group_domains(writer, group, domains)
+                backend.finished(job_id, status)
+            if domains is None:
+                failed += len(group['genes'])
+                print(f"✗ {describe_group(group)}: {status}")
+            else:
+                if cache and version:
+                    cache.put(group['protein_seq'], domains, version)
+                completed += len(group['genes'])
+                print(f"✓ {describe_group(group)}: {len(domains)} domains")
+        except Exception as e:
+            # Counts toward MAX_FAILED_RUNS like a failed job
+            for gene in group['genes']:
+                record_gene_status(writer, gene, 'failed')
+            failed += len(group['genes'])
+            print(f"Error annotating {describe_group(group)}: {e}")
+        finally:
+            # No await since the writes above, so no gene can join the group late
+            del pending[group['protein_seq']]
+            slots.release()
+            progress.update(len(group['genes']))
+            progress.set_postfix_str(f"ETA {batch_eta() / 60:.1f} min")
+
+    async def flush_ticker():
+        # The writer only checks its interval on write, and long remote
+        # polls can leave it idle with finished rows still buffered
+        while True:
+            await asyncio.sleep(writer.flush_interval)
+            writer.maybe_flush()
+
+    async with backend:
+        ticker = asyncio.create_task(flush_ticker())
+        tasks = set()
+        for gene in genes:
+            gene_count += 1
+            protein_seq = gene['protein_seq']
+
+            group = pending.get(protein_seq)
+            if group:
+                group['genes'].append(gene)
+                continue
+
+            protein_count += 1
+            domains = cache.get(protein_seq) if cache else None
+            if domains is not None:
+                record_gene_domains(writer, gene, domains)
+                completed += 1
+                progress.update(1)
+                continue
+
+            # Only start a new job once a slot frees up
+            await slots.acquire()
+            job_count += 1
+            group = {'protein_seq': protein_seq, 'genes': [gene]}
+            pending[protein_seq] = group
+            task = asyncio.create_task(process(group))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        await backend.drain()
+        if tasks:
+            await asyncio.gather(*tasks)
+        ticker.cancel()
+
+    progress.close()
+
+    backend.report(job_count)
+    if gene_count:
+        print(f"Deduplicated {gene_count} genes to {protein_count} unique proteins "
+              f"(ratio {gene_count / protein_count:.2f}x, {gene_count - protein_count} jobs saved)")
+
+    return completed, failed
+
+
+def index_genes(db_path: str) -> tuple[dict[str, list[dict]], dict[str, list[dict]]]:
+    """Index CDS genes by the identifiers an imported result may carry.
+
+    Returns (by_id, by_md5): by_id maps locus tags and protein hashes to
+    genes, by_md5 maps the MD5 of each protein (the md5 field InterProScan
+    writes for every result). Protein sequences are dropped, so the index
+    holds only gene metadata.
+    """
+    by_id: dict[str, list[dict]] = defaultdict(list)
+    by_md5: dict[str, list[dict]] = defaultdict(list)
+
+    def add(gene: dict):
+        gene['md5'] = hashlib.md5(gene.pop('protein_seq').encode('ascii')).hexdigest()
+        by_id[gene['locus_tag']].append(gene)
+        by_id[gene['protein_hash']].append(gene)
+        by_md5[gene['md5']].append(gene)
+
+    # Short proteins are indexed too; precomputed runs may have included them
+    for gene in get_gene_proteins(db_path, on_too_short=add):
+        add(gene)
+
+    return by_id, by_md5
+
+
+def import_results(
+    writer: BatchWriter,
+    paths: list[Path],
+    by_id: dict[str, list[dict]],
+    by_md5: dict[str, list[dict]],
+) -> tuple[int, int, int, str | None]:
+    """Load precomputed InterProScan JSON/TSV results into protein_domains.
+
+    Files are stream-parsed one result at a time. Each result is matched to
+    genes by its query ID (a locus tag or protein hash), falling back to the
+    MD5 of its sequence; genes whose protein no longer has that MD5 are
+    skipped as stale. A gene's old domains are replaced the first time it
+    is matched; later results for it (non-adjacent TSV rows, or the same
+    protein in another file) only add domains it does not have yet.
+    Returns (genes imported, unmatched results, stale genes, InterProScan
+    version).
+    """
+    imported: set[int] = set()
+    unmatched = 0
+    stale = 0
+    header = {}
+    progress = tqdm(desc="Importing", unit="result")
+
+    for path in paths:
+        for result in iter_result_file(path, header):
+            progress.update(1)
+            md5 = result.get('md5') or ''
+            if not md5 and result.get('sequence'):
+                md5 = hashlib.md5(result['sequence'].upper().encode('ascii')).hexdigest()
+            md5 = md5.lower()
+
+            query_id = result_query_id(result) or ''
+            genes = by_id.get(query_id) or by_md5.get(md5, [])
+            if not genes:
+                unmatched += 1
+                continue
+            if md5:
+                current = [gene for gene in genes if gene['md5'] == md5]
+                stale += len(genes) - len(current)
+                genes = current
+
+            domains = parse_interpro_result({'results': [result]})
+            for gene in genes:
+                if gene['gene_id'] not in imported:
+                    record_gene_domains(writer, gene, domains)
+                    imported.add(gene['gene_id'])
+                elif domains:
+                    insert_missing_domains(writer, gene, domains)
+                    record_gene_status(writer, gene, 'annotated')
+
+    progress.close()
+    return len(imported), unmatched, stale, header.get('interproscan-version')
+
+
+def main(argv: list[str] | None = None, ctx: PipelineContext | None = None):
     parser = argparse.ArgumentParser(description="Annotate protein domains via InterProScan")
     parser.add_argument("--db", required=True, help="Path to phage.db")
-    parser.add_argument("--force", action="store_true", help="Re-annotate existing genes")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-annotate all genes, ignoring gene_annotation_status")
     parser.add_argument("--limit", type=int, help="Limit number of genes to process")
+    parser.add_argument("--backend", choices=["remote", "local"], default="remote",
+                        help="Run InterProScan at EBI (remote) or via a local interproscan.sh")
     parser.add_argument("--email", default="phage-explorer@example.com", help="Email for InterProScan")
-    args = parser.parse_args()
+    parser.add_argument("--max-in-flight", type=int, default=MAX_JOBS_IN_FLIGHT,
+                        help="Maximum InterProScan jobs submitted but not yet finished")
+    parser.add_argument("--max-requests", type=int, default=MAX_CONCURRENT_REQUESTS,
+                        help="Maximum concurrent HTTP requests to EBI")
+    parser.add_argument("--interproscan", default=DEFAULT_INTERPROSCAN,
+                        help="Path to interproscan.sh for the local backend")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE,
+                        help="Proteins per interproscan.sh run (local backend)")
+    parser.add_argument("--local-workers", type=int, default=DEFAULT_LOCAL_WORKERS,
+                        help="Concurrent interproscan.sh processes (local backend)")
+    parser.add_argument("--local-cpu", type=int, default=DEFAULT_LOCAL_CPU,
+                        help="CPUs given to each interproscan.sh process (local backend)")
+    parser.add_argument("--local-format", choices=["json", "tsv"], default="json",
+                        help="interproscan.sh output format to parse (local backend)")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR),
+                        help="Directory for cached InterProScan results")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_MAX_MB,
+                        help="Size budget for the result cache in MB")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the result cache")
+    parser.add_argument("--import-results", nargs="+", metavar="FILE",
+                        help="Import precomputed InterProScan JSON/TSV files instead of running jobs")
+    parser.add_argument("--flush-size", type=int, default=DEFAULT_FLUSH_SIZE,
+                        help="Buffered domain rows that trigger a database write")
+    parser.add_argument("--flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL,
+                        help="Maximum seconds between database writes")
+    args = parser.parse_args(argv)
 
     db_path = Path(args.db)
     if not db_path.exists():
@@ -278,94 +609,84 @@ def main():
 
     ensure_tables(str(db_path))
 
-    # Get genes to annotate
-    genes = list(get_gene_proteins(str(db_path)))
-
-    if args.limit:
-        genes = genes[:args.limit]
-
-    print(f"Found {len(genes)} CDS genes to annotate")
-
-    # Check which genes already have annotations
-    if not args.force:
-        conn = sqlite3.connect(str(db_path))
-        annotated = set(
-            row[0] for row in
-            conn.execute("SELECT DISTINCT gene_id FROM protein_domains WHERE gene_id IS NOT NULL")
-        )
-        conn.close()
+    if args.import_results:
+        paths = [Path(p) for p in args.import_results]
+        missing = [str(p) for p in paths if not p.exists()]
+        if missing:
+            print(f"Error: Result files not found: {', '.join(missing)}")
+            return 1
+
+        print("Indexing genes by locus tag and protein hash...")
+        by_id, by_md5 = index_genes(str(db_path))
+        with BatchWriter(str(db_path), args.flush_size, args.flush_interval) as writer:
+            imported, unmatched, stale, version = import_results(writer, paths, by_id, by_md5)
+            source = f"InterProScan {version}" if version else "InterProScan"
+            writer.add("""
+                INSERT OR REPLACE INTO annotation_meta (key, value, updated_at)
+                VALUES ('domains_last_updated', ?, ?)
+            """, (f"{source} import, {imported} genes", int(time.time())))
+
+        print(f"\nDone! Imported domains for {imported} genes "
+              f"({unmatched} unmatched results, {stale} stale genes skipped)")
+        return 0
 
-        genes = [g for g in genes if g['gene_id'] not in annotated]
-        print(f"Skipping already annotated genes, {len(genes)} remaining")
+    candidates = count_cds_genes(str(db_path), skip_annotated=not args.force)
+    print(f"Found {candidates} CDS genes to annotate")
 
-    if not genes:
+    if not candidates:
         print("No genes to annotate")
         return 0
 
-    # Process genes
-    jobs = {}  # job_id -> gene info
-
-    for gene in tqdm(genes, desc="Submitting jobs"):
+    if args.backend == "local":
         try:
-            job_id = submit_interpro_job(gene['protein_seq'], args.email)
-            jobs[job_id] = gene
-            time.sleep(REQUEST_DELAY)
-        except Exception as e:
-            print(f"Error submitting {gene['locus_tag']}: {e}")
-
-    print(f"Submitted {len(jobs)} jobs, waiting for results...")
-
-    # Poll for results
-    completed = 0
-    failed = 0
-
-    while jobs:
-        time.sleep(POLL_INTERVAL)
-
-        finished_jobs = []
-
-        for job_id, gene in jobs.items():
-            try:
-                status = check_job_status(job_id)
-
-                if status == 'FINISHED':
-                    result = get_job_result(job_id)
-                    domains = parse_interpro_result(result)
-
-                    insert_domains(
-                        str(db_path),
-                        gene['gene_id'],
-                        gene['phage_id'],
-                        gene['locus_tag'],
-                        domains
-                    )
-
-                    completed += 1
-                    finished_jobs.append(job_id)
-                    print(f"✓ {gene['locus_tag']}: {len(domains)} domains")
-
-                elif status in ('FAILURE', 'ERROR', 'NOT_FOUND'):
-                    failed += 1
-                    finished_jobs.append(job_id)
-                    print(f"✗ {gene['locus_tag']}: {status}")
-
-            except Exception as e:
-                print(f"Error checking {job_id}: {e}")
-
-        for job_id in finished_jobs:
-            del jobs[job_id]
-
-        if jobs:
-            print(f"Waiting for {len(jobs)} jobs... (completed: {completed}, failed: {failed})")
+            backend = LocalBackend(args.interproscan, args.shard_size, args.local_workers,
+                                   args.local_cpu, args.local_format)
+        except FileNotFoundError as e:
+            print(f"Error: {e}")
+            return 1
+
+    writer = BatchWriter(str(db_path), args.flush_size, args.flush_interval)
+    if args.backend == "remote":
+        backend = RemoteBackend(writer, args.email, args.max_in_flight, args.max_requests, ctx)
+
+    # Lazily stream genes; --limit stops reading genomes once reached
+    gene_stream = get_gene_proteins(
+        str(db_path),
+        skip_annotated=not args.force,
+        on_too_short=lambda gene: record_gene_status(writer, gene, 'too_short'),
+        ctx=ctx,
+    )
+    genes = islice(gene_stream, args.limit) if args.limit else gene_stream
+
+    if args.no_cache:
+        # Throwaway cache so duplicates of finished proteins are still resolved locally
+        scratch = tempfile.TemporaryDirectory()
+        cache = InterProCache(Path(scratch.name))
+    else:
+        cache = InterProCache(Path(args.cache_dir), args.cache_max_mb)
+
+    print(f"Annotating with up to {backend.max_in_flight} proteins in flight ({backend.name})...")
+    try:
+        completed, failed = run_coroutine(run_jobs(
+            writer, genes, backend, cache,
+            expected_total=min(candidates, args.limit) if args.limit else candidates,
+        ), ctx)
+    finally:
+        gene_stream.close()
+        writer.flush()
+
+    if args.no_cache:
+        scratch.cleanup()
+    else:
+        removed = cache.prune()
+        print(f"Result cache: {cache.stats()}, evicted {removed / (1024 * 1024):.1f} MB")
 
     # Update metadata
-    conn = sqlite3.connect(str(db_path))
-    conn.execute("""
+    writer.add("""
         INSERT OR REPLACE INTO annotation_meta (key, value, updated_at)
         VALUES ('domains_last_updated', ?, ?)
-    """, (f"InterProScan, {completed} genes", int(time.time())))
-    conn.commit()
-    conn.close()
+    """, (f"InterProScan ({backend.name}), {completed} genes", int(time.time())))
+    writer.close()
 
     print(f"\nDone! Annotated {completed} genes, {failed} failed")
     return 0
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Codon Adaptation Calculation
+
+Scores every phage CDS against every host in host_trna_pools and fills
+the codon_adaptation table:
+
+    tai        tRNA adaptation index (dos Reis et al. 2004) from the host's
+               compiled, wobble-aware codon weights
+    cai        left NULL: CAI (Sharp & Li 1987) needs a reference set of
+               highly expressed host genes, which host_trna_pools does
+               not provide
+    cpb        codon pair bias (Coleman et al. 2008) against the phage's
+               own codon pair usage
+    enc_prime  effective number of codons corrected for nucleotide
+               composition (Novembre 2002)
+
+Each phage's stored genes x 64 codon-count matrix (codon_matrix.py) is
+scored against one 64-element log-weight vector per host, so scoring all
+genes against all hosts is a single matrix product per index.
+
+relative_weights() also yields a family-relative tAI ("tai_family"):
+each codon's host tRNA weight relative to the best-decoded codon of its
+synonymous family, as CAI does with codon usage. It is used by the
+profile and ranking steps and is not stored here.
+
+Usage:
+    python codon_matrix.py --db phage.db
+    python codon_adaptation.py --db phage.db
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from codon_matrix import iter_codon_matrices
+from db_writer import BatchWriter
+from host_trna_data import ensure_tables, load_scoring_inputs
+from pipeline_context import PipelineContext, connect
+from sequence_utils import AMBIGUOUS_CODON, CODONS, GENETIC_CODE
+
+AMINO_ACIDS = sorted(set(GENETIC_CODE) - {'*'})
+
+# Codon -> amino acid index into AMINO_ACIDS (-1 for stop codons)
+CODON_AA = np.array([AMINO_ACIDS.index(aa) if aa != '*' else -1 for aa in GENETIC_CODE])
+STOP_CODONS = CODON_AA < 0
+
+# Codons x amino acids membership matrix of the synonymous families
+FAMILY = np.zeros((64, len(AMINO_ACIDS)))
+FAMILY[~STOP_CODONS, CODON_AA[~STOP_CODONS]] = 1
+FAMILY_SIZE = FAMILY.sum(axis=0).astype(int)
+
+# tAI ignores stop codons and Met; family-relative tAI also ignores every
+# other single-codon family
+TAI_CODONS = ~STOP_CODONS & (np.array(CODONS) != 'ATG')
+FAMILY_CODONS = ~STOP_CODONS & (FAMILY_SIZE[np.maximum(CODON_AA, 0)] > 1)
+
+# Codon x base matrix counting how often each base (TCAG) occurs in a codon
+CODON_BASES = np.zeros((64, 4))
+for _i, _codon in enumerate(CODONS):
+    for _base in _codon:
+        CODON_BASES[_i, 'TCAG'.index(_base)] += 1
+
+INSERT_ADAPTATION_SQL = """
+    INSERT INTO codon_adaptation
+    (phage_id, host_name, gene_id, locus_tag, tai, cpb, enc_prime)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def relative_weights(weights: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Log relative adaptiveness for tAI and family-relative tAI from raw host weights.
+
+    tAI weights are normalized by the host's largest weight and
+    family-relative weights by the largest weight of the codon's synonymous
+    family. Sense codons with no decoding tRNA get the geometric mean of
+    the other weights.
+    """
+    w = weights / np.maximum(weights.max(axis=1, keepdims=True), 1e-12)
+    sense = ~STOP_CODONS
+    for h in range(len(w)):
+        present = sense & (w[h] > 0)
+        fill = np.exp(np.log(w[h, present]).mean()) if present.any() else 1.0
+        w[h, sense & (w[h] == 0)] = fill
+    w[:, STOP_CODONS] = 1.0
+
+    family_max = (w[:, :, None] * FAMILY).max(axis=1)
+    w_family = w / np.maximum(family_max @ FAMILY.T, 1e-12)
+    w_family[:, STOP_CODONS] = 1.0
+    return np.log(w), np.log(w_family)
+
+
+def geometric_means(counts: np.ndarray, log_weights: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Genes x hosts geometric mean weight over the codons in mask."""
+    used = counts[:, mask]
+    totals = used.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.exp(used @ log_weights[:, mask].T / totals)
+
+
+def codon_pair_bias(codons: list[np.ndarray], counts: np.ndarray) -> np.ndarray:
+    """Per-gene codon pair bias against the codon pair usage of all given genes."""
+    pairs, rows = [], []
+    for i, c in enumerate(codons):
+        c = c.astype(np.int64)
+        keep = (c[:-1] != AMBIGUOUS_CODON) & (c[1:] != AMBIGUOUS_CODON)
+        pairs.append((c[:-1] * 64 + c[1:])[keep])
+        rows.append(np.full(int(keep.sum()), i))
+    if not pairs or not sum(len(p) for p in pairs):
+        return np.full(len(codons), np.nan)
+    pairs, rows = np.concatenate(pairs), np.concatenate(rows)
+
+    pair_counts = np.bincount(pairs, minlength=64 * 64).reshape(64, 64).astype(float)
+    codon_totals = counts.sum(axis=0)
+    aa_totals = codon_totals @ FAMILY
+    aa_pairs = FAMILY.T @ pair_counts @ FAMILY
+
+    # Expected pair count if codon choice is independent of the neighbouring codon
+    codon_aa_totals = aa_totals @ FAMILY.T
+    aa = np.maximum(CODON_AA, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        expected = (np.outer(codon_totals, codon_totals)
+                    / np.outer(codon_aa_totals, codon_aa_totals)
+                    * aa_pairs[np.ix_(aa, aa)])
+        scores = np.log(pair_counts / expected)
+    # Pairs involving a stop codon have no amino acid pair to compare against
+    scores[STOP_CODONS, :] = 0
+    scores[:, STOP_CODONS] = 0
+    scores[~np.isfinite(scores)] = 0
+
+    sums = np.bincount(rows, weights=scores.ravel()[pairs], minlength=len(codons))
+    n_pairs = np.bincount(rows, minlength=len(codons))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / n_pairs
+
+
+def effective_codons(counts: np.ndarray) -> np.ndarray:
+    """Per-gene ENC' with expected codon usage from the gene's base composition."""
+    n_genes = len(counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        base_freq = (counts @ CODON_BASES) / (3 * counts.sum(axis=1, keepdims=True))
+        expected = np.ones((n_genes, 64))
+        for position in range(3):
+            bases = ['TCAG'.index(codon[position]) for codon in CODONS]
+            expected *= base_freq[:, bases]
+        expected /= (expected @ FAMILY) @ FAMILY.T
+
+        aa_counts = counts @ FAMILY
+        observed = counts / (aa_counts @ FAMILY.T)
+        # Stop codons and absent amino acids give NaN terms, which must not leak into other families
+        deviation = np.nan_to_num((observed - expected) ** 2 / expected, nan=0.0, posinf=0.0)
+        chi2 = (deviation @ FAMILY) * aa_counts
+        f = (chi2 + aa_counts - FAMILY_SIZE) / (FAMILY_SIZE * (aa_counts - 1))
+    usable = aa_counts > 1
+    f = np.where(usable, f, 0)
+
+    # Average homozygosity per degeneracy class, weighted by amino acid counts
+    enc = np.zeros(n_genes)
+    class_f = {}
+    for k in (2, 3, 4, 6):
+        in_class = FAMILY_SIZE == k
+        weight = (aa_counts * usable)[:, in_class]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            class_f[k] = (f[:, in_class] * weight).sum(axis=1) / weight.sum(axis=1)
+    # Ile is the only three-fold family; estimate it from the others when absent
+    class_f[3] = np.where(np.isnan(class_f[3]), (class_f[2] + class_f[4]) / 2, class_f[3])
+
+    enc += (FAMILY_SIZE == 1).sum()
+    for k in (2, 3, 4, 6):
+        with np.errstate(divide='ignore'):
+            enc = enc + (FAMILY_SIZE == k).sum() / class_f[k]
+    return np.clip(enc, 20, 61)
+
+
+def _value(x: float) -> float | None:
+    return round(float(x), 4) if np.isfinite(x) else None
+
+
+def calculate_adaptation(db_path: str, ctx: PipelineContext | None = None):
+    """Recompute codon_adaptation for every phage against every host."""
+    writer = BatchWriter(db_path)
+    conn = connect(db_path, ctx)
+
+    inputs = load_scoring_inputs(writer, conn)
+    if inputs is None:
+        conn.close()
+        writer.close()
+        return
+    phage_count, hosts, weights = inputs
+
+    log_tai, _ = relative_weights(weights)
+    print(f"Scoring against {len(hosts)} hosts")
+
+    locus_tags = dict(conn.execute("SELECT id, locus_tag FROM genes WHERE type = 'CDS'"))
+
+    gene_count = 0
+    for matrix in tqdm(iter_codon_matrices(conn), total=phage_count, desc="Codon adaptation"):
+        counts = matrix.counts.astype(float)
+        tai = geometric_means(counts, log_tai, TAI_CODONS)
+        cpb = codon_pair_bias(matrix.gene_codons(), counts)
+        enc = effective_codons(counts)
+
+        gene_ids = matrix.gene_ids.tolist()
+        writer.add("DELETE FROM codon_adaptation WHERE phage_id = ?", (matrix.phage_id,))
+        writer.add_many(INSERT_ADAPTATION_SQL, (
+            (matrix.phage_id, host, gene_id, locus_tags.get(gene_id) or f"gene_{gene_id}",
+             _value(tai[g, h]), _value(cpb[g]), _value(enc[g]))
+            for h, host in enumerate(hosts)
+            for g, gene_id in enumerate(gene_ids)
+        ))
+        gene_count += len(gene_ids)
+
+    conn.close()
+
+    writer.add("""
+        INSERT OR REPLACE INTO annotation_meta (key, value, updated_at)
+        VALUES ('codon_adaptation_updated', ?, ?)
+    """, (f"{gene_count} genes x {len(hosts)} hosts", int(time.time())))
+    writer.close()
+
+    print(f"Scored {gene_count} genes against {len(hosts)} hosts")
+
+
+def main(argv: list[str] | None = None, ctx: PipelineContext | None = None):
+    parser = argparse.ArgumentParser(description="Calculate codon adaptation of phage genes to host tRNA pools")
+    parser.add_argument("--db", required=True, help="Path to phage.db")
+    args = parser.parse_args(argv)
+
+    db_path = Path(args.db)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        return 1
+
+    ensure_tables(str(db_path))
+    calculate_adaptation(str(db_path), ctx)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
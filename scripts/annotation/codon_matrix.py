@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Per-Gene Codon Count Matrices
+
+Walks every CDS once and stores, per phage, a genes x 64 uint32 codon
+count matrix in the gene_codon_matrix table of phage.db. Alongside it are
+the gene ids of the matrix rows and each gene's in-frame codon stream
+(uint8 codon indices, concatenated, with uint32 row offsets) for metrics
+that need codon order, such as codon pair bias.
+
+A phage is only recounted when its CDS coordinates or genome sequence
+change. Consumers only read the stored matrices, loading the blobs with
+np.frombuffer without copying and without touching the genome sequence,
+so this must run first whenever genes or sequences change.
+
+Usage:
+    python codon_matrix.py --db phage.db [--full]
+
+    matrix = load_codon_matrix(conn, phage_id)
+    matrix.counts        # genes x 64 uint32
+    matrix.codons_of(i)  # codon indices of row i
+"""
+
+import argparse
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from db_writer import BatchWriter
+from pipeline_context import PipelineContext, connect, read_genome
+from sequence_utils import gene_codons
+
+# AMBIGUOUS_CODON (64) is kept in codon streams but has no count column
+CODON_COLUMNS = 64
+
+
+def ensure_matrix_table(conn: sqlite3.Connection):
+    """Create the gene_codon_matrix table if it does not exist."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS gene_codon_matrix (
+            phage_id INTEGER PRIMARY KEY,
+            gene_count INTEGER NOT NULL,
+            gene_ids BLOB NOT NULL,
+            counts BLOB NOT NULL,
+            offsets BLOB NOT NULL,
+            codons BLOB NOT NULL,
+            signature TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+    conn.commit()
+
+
+class CodonMatrix:
+    """One phage's stored codon counts, as read-only arrays over the row blobs."""
+
+    def __init__(self, phage_id: int, gene_ids: bytes, counts: bytes, offsets: bytes, codons: bytes):
+        self.phage_id = phage_id
+        self.gene_ids = np.frombuffer(gene_ids, dtype='<i8')
+        self.counts = np.frombuffer(counts, dtype='<u4').reshape(len(self.gene_ids), CODON_COLUMNS)
+        self.offsets = np.frombuffer(offsets, dtype='<u4')
+        self.codons = np.frombuffer(codons, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.gene_ids)
+
+    def codons_of(self, row: int) -> np.ndarray:
+        """In-frame codon indices of the gene in matrix row `row`."""
+        return self.codons[self.offsets[row]:self.offsets[row + 1]]
+
+    def gene_codons(self) -> list[np.ndarray]:
+        return [self.codons_of(i) for i in range(len(self))]
+
+
+def count_matrix(codons: list[np.ndarray]) -> np.ndarray:
+    """Genes x 64 uint32 codon counts; ambiguous codons are dropped."""
+    lengths = [len(c) for c in codons]
+    if not sum(lengths):
+        return np.zeros((len(codons), CODON_COLUMNS), dtype=np.uint32)
+    rows = np.repeat(np.arange(len(codons)), lengths)
+    flat = np.concatenate(codons).astype(np.int64)
+    counts = np.bincount(rows * 65 + flat, minlength=len(codons) * 65)
+    return counts.reshape(len(codons), 65)[:, :CODON_COLUMNS].astype(np.uint32)
+
+
+def phage_signature(conn: sqlite3.Connection, phage_id: int) -> str:
+    """Hash of a phage's CDS coordinates and genome sequence."""
+    digest = hashlib.sha256()
+    for row in conn.execute("""
+        SELECT id, start_pos, end_pos, strand FROM genes
+        WHERE type = 'CDS' AND phage_id = ? ORDER BY start_pos, id
+    """, (phage_id,)):
+        digest.update(f"{row}\n".encode())
+    # Same-length sequence corrections must invalidate the counts too
+    digest.update(b"sequence=")
+    for (chunk,) in conn.execute(
+        "SELECT sequence FROM sequences WHERE phage_id = ? ORDER BY chunk_index", (phage_id,)
+    ):
+        digest.update(chunk.encode())
+    return digest.hexdigest()
+
+
+def build_codon_matrices(db_path: str, full: bool = False, ctx: PipelineContext | None = None) -> tuple[int, int]:
+    """Count codons of every phage whose CDSs changed. Returns (built, unchanged)."""
+    writer = BatchWriter(db_path)
+    conn = connect(db_path, ctx)
+    ensure_matrix_table(conn)
+
+    phage_ids = [
+        row[0] for row in conn.execute(
+            "SELECT DISTINCT phage_id FROM genes WHERE type = 'CDS' ORDER BY phage_id"
+        )
+    ]
+    stored = {} if full else dict(conn.execute("SELECT phage_id, signature FROM gene_codon_matrix"))
+
+    built = 0
+    for phage_id in tqdm(phage_ids, desc="Codon matrices"):
+        signature = phage_signature(conn, phage_id)
+        if stored.get(phage_id) == signature:
+            continue
+
+        rows = conn.execute("""
+            SELECT id, start_pos, end_pos, strand FROM genes
+            WHERE type = 'CDS' AND phage_id = ? ORDER BY start_pos, id
+        """, (phage_id,)).fetchall()
+        genome = ctx.genome(phage_id) if ctx else read_genome(conn, phage_id)
+
+        codons = gene_codons(genome, [(row[1], row[2], row[3]) for row in rows])
+        offsets = np.concatenate([[0], np.cumsum([len(c) for c in codons])]).astype('<u4')
+        stream = np.concatenate(codons).astype(np.uint8) if codons else np.empty(0, dtype=np.uint8)
+
+        writer.add("""
+            INSERT OR REPLACE INTO gene_codon_matrix
+            (phage_id, gene_count, gene_ids, counts, offsets, codons, signature, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            phage_id, len(rows),
+            np.array([row[0] for row in rows], dtype='<i8').tobytes(),
+            count_matrix(codons).astype('<u4').tobytes(),
+            offsets.tobytes(), stream.tobytes(),
+            signature, int(time.time()),
+        ))
+        built += 1
+
+    # Drop matrices of phages that no longer have CDSs
+    writer.add_many(
+        "DELETE FROM gene_codon_matrix WHERE phage_id = ?",
+        ((phage_id,) for phage_id in set(stored) - set(phage_ids)),
+    )
+
+    conn.close()
+    writer.close()
+    return built, len(phage_ids) - built
+
+
+def stored_matrix_count(conn: sqlite3.Connection) -> int:
+    """Number of phages with a stored codon matrix; 0 if none were ever built."""
+    try:
+        return conn.execute("SELECT COUNT(*) FROM gene_codon_matrix").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+
+def load_codon_matrix(conn: sqlite3.Connection, phage_id: int) -> CodonMatrix | None:
+    row = conn.execute("""
+        SELECT gene_ids, counts, offsets, codons FROM gene_codon_matrix WHERE phage_id = ?
+    """, (phage_id,)).fetchone()
+    return CodonMatrix(phage_id, *row) if row else None
+
+
+def iter_codon_matrices(conn: sqlite3.Connection):
+    """Yield the stored CodonMatrix of every phage, in phage order."""
+    phage_ids = [row[0] for row in conn.execute("SELECT phage_id FROM gene_codon_matrix ORDER BY phage_id")]
+    for phage_id in phage_ids:
+        yield load_codon_matrix(conn, phage_id)
+
+
+def main(argv: list[str] | None = None, ctx: PipelineContext | None = None):
+    parser = argparse.ArgumentParser(description="Build per-gene codon count matrices")
+    parser.add_argument("--db", required=True, help="Path to phage.db")
+    parser.add_argument("--full", action="store_true", help="Recount every phage")
+    args = parser.parse_args(argv)
+
+    db_path = Path(args.db)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        return 1
+
+    built, unchanged = build_codon_matrices(str(db_path), args.full, ctx)
+    print(f"Codon matrices: {built} built, {unchanged} unchanged")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
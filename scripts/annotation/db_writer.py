@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Batched SQLite Writer
+
+Shared write path for the annotation scripts. A BatchWriter holds a single
+connection in WAL mode, buffers statements, and writes them with
+executemany in one transaction per flush. A flush happens once flush_size
+rows are buffered or flush_interval seconds have passed, so per-row
+commits no longer stall the caller. The interval is only checked when
+rows are added; callers that can sit idle with rows buffered (e.g. while
+polling remote jobs) call maybe_flush() on a timer.
+
+Usage:
+    with BatchWriter(db_path) as writer:
+        writer.add_many("INSERT INTO t (a, b) VALUES (?, ?)", rows)
+"""
+
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterable
+
+DEFAULT_FLUSH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 5.0  # seconds
+
+# Set by the pipeline scheduler while steps share the database concurrently;
+# it switches the journal mode back itself once every step has finished
+KEEP_WAL_ENV = "PHAGE_DB_KEEP_WAL"
+
+
+def leave_wal(conn: sqlite3.Connection):
+    """Checkpoint the WAL and switch the database back to rollback-journal mode."""
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("PRAGMA journal_mode=DELETE")
+    except sqlite3.OperationalError:
+        # Another connection still has the database open; it stays in WAL mode
+        pass
+
+
+class BatchWriter:
+    """Buffers writes and commits them in batches over one connection."""
+
+    def __init__(self, db_path: str, flush_size: int = DEFAULT_FLUSH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        # Pipeline steps may run concurrently; wait out their write locks
+        # A step run in-process may hand its writer to the shared event loop
+        # thread; it is still only used by one thread at a time
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        # Consecutive rows for the same statement share one executemany batch
+        self._batches: list[tuple[str, list[tuple]]] = []
+        self._buffered = 0
+        self._held = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, sql: str, row: tuple = ()):
+        """Queue one statement execution."""
+        self.add_many(sql, [row])
+
+    def add_many(self, sql: str, rows: Iterable[tuple]):
+        """Queue a statement for each row, preserving order relative to other statements."""
+        rows = list(rows)
+        if not rows:
+            return
+
+        if self._batches and self._batches[-1][0] == sql:
+            self._batches[-1][1].extend(rows)
+        else:
+            self._batches.append((sql, rows))
+        self._buffered += len(rows)
+
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        """Flush if the buffer is full or the flush interval has elapsed."""
+        if not self._buffered or self._held:
+            return
+        if (self._buffered >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write all buffered statements in a single transaction."""
+        if self._batches:
+            with self.conn:
+                for sql, rows in self._batches:
+                    self.conn.executemany(sql, rows)
+            self.rows_written += self._buffered
+            self._batches = []
+            self._buffered = 0
+        self._last_flush = time.monotonic()
+
+    @contextmanager
+    def hold(self):
+        """Defer automatic flushes, so rows queued inside are committed together."""
+        self._held += 1
+        try:
+            yield
+        finally:
+            self._held -= 1
+            self.maybe_flush()
+
+    def close(self):
+        """Flush remaining rows and leave the database in rollback-journal mode.
+
+        The database is shipped to the web viewer as a single file, so the
+        WAL is checkpointed and switched off rather than left beside it.
+        """
+        self.flush()
+        if not os.environ.get(KEEP_WAL_ENV):
+            leave_wal(self.conn)
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
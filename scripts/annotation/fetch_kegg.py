@@ -6,24 +6,36 @@ Identifies Auxiliary Metabolic Genes (AMGs) by mapping protein domains
 to KEGG orthologs and pathways.
 
 Usage:
-    python fetch_kegg.py --db phage.db
+    python fetch_kegg.py --db phage.db [--bulk]
+    python fetch_kegg.py --refresh-snapshot kegg_snapshot.db
+    python fetch_kegg.py --db phage.db --snapshot kegg_snapshot.db
 """
 
 import argparse
+import asyncio
 import json
 import re
 import sqlite3
 import time
+from collections import defaultdict
 from pathlib import Path
 
-import requests
+import aiohttp
 from tqdm import tqdm
 
-# KEGG REST API base URL
-KEGG_API = "https://rest.kegg.jp"
+from db_writer import BatchWriter
+from kegg_cache import DEFAULT_TTL_DAYS, KeggCache, ensure_cache_table
+from kegg_client import KEGG_RATE, KeggClient, new_session
+from kegg_snapshot import KeggSnapshot, write_snapshot
+from pipeline_context import PipelineContext, run_coroutine
 
-# Rate limiting for KEGG API
-REQUEST_DELAY = 0.2  # 10 requests/second max
+PFAM_ACCESSION = re.compile(r'^PF\d{5}$')
+
+# InterPro API listing the Pfam signatures integrated into an InterPro entry
+INTERPRO_PFAM_MEMBERS = "https://www.ebi.ac.uk/interpro/api/entry/pfam/interpro/{interpro_id}/?page_size=200"
+
+# annotation_meta key holding the highest protein_domains.id already scanned
+AMG_WATERMARK_KEY = 'amg_domains_watermark'
 
 # Known AMG-associated KEGG pathways
 AMG_PATHWAYS = {
@@ -80,48 +92,187 @@ AMG_ORTHOLOGS = {
 }
 
 
-def get_ko_from_domain(domain_id: str, domain_name: str) -> list[str]:
-    """Map a Pfam/InterPro domain to KEGG orthologs."""
+def strip_prefix(entry: str) -> str:
+    """Drop the database prefix from a KEGG entry ("ko:K00525" -> "K00525")."""
+    return entry.split(':', 1)[-1]
+
+
+async def get_ko_from_domain(client: KeggClient, domain_id: str, cache: KeggCache | None = None) -> list[str] | None:
+    """Map a Pfam domain to KEGG orthologs; None if KEGG could not be reached."""
+    kos = cache.get('pfam_ko', domain_id) if cache else None
+    if kos is not None:
+        return kos
+
     # Query KEGG for Pfam mapping
-    url = f"{KEGG_API}/link/ko/pfam:{domain_id}"
+    linked = await client.link('ko', f"pfam:{domain_id}")
+    if linked is None:
+        # Not cached, so the lookup is retried next time
+        return None
+
+    kos = [strip_prefix(ko) for ko in linked]
+    if cache:
+        cache.put('pfam_ko', domain_id, kos)
+    return kos
+
+
+async def get_ko_links(
+    client: KeggClient, kind: str, target: str, ko_id: str, cache: KeggCache | None = None,
+) -> list[str] | None:
+    """Entries of `target` (pathway, reaction) linked to a KO, via the cache; None if unreachable."""
+    linked_ids = cache.get(kind, ko_id) if cache else None
+    if linked_ids is None:
+        linked = await client.link(target, f"ko:{ko_id}")
+        if linked is None:
+            return None
+        linked_ids = [strip_prefix(entry) for entry in linked]
+        if cache:
+            cache.put(kind, ko_id, linked_ids)
+    return linked_ids
+
+
+def amg_pathways(pathway_ids: list[str]) -> list[dict]:
+    """Keep the pathways listed in AMG_PATHWAYS, with their type and name."""
+    return [
+        {'pathway_id': pathway_id, **AMG_PATHWAYS[pathway_id]}
+        for pathway_id in pathway_ids
+        if pathway_id in AMG_PATHWAYS
+    ]
+
+
+async def get_pathways_for_ko(client: KeggClient, ko_id: str, cache: KeggCache | None = None) -> list[dict] | None:
+    """Get KEGG pathways for a given KO; None if KEGG could not be reached."""
+    # Every pathway is cached so edits to AMG_PATHWAYS do not need a refetch
+    pathway_ids = await get_ko_links(client, 'ko_pathway', 'pathway', ko_id, cache)
+    return None if pathway_ids is None else amg_pathways(pathway_ids)
+
+
+async def get_reactions_for_ko(client: KeggClient, ko_id: str, cache: KeggCache | None = None) -> list[str] | None:
+    """Get KEGG reactions for a given KO; None if KEGG could not be reached."""
+    return await get_ko_links(client, 'ko_reaction', 'reaction', ko_id, cache)
+
+
+async def gather_with_progress(coros: list, desc: str) -> list:
+    """Run coroutines concurrently, ticking a progress bar as each finishes."""
+    progress = tqdm(total=len(coros), desc=desc)
+
+    async def tick(coro):
+        try:
+            return await coro
+        finally:
+            progress.update(1)
 
     try:
-        resp = requests.get(url, timeout=30)
-        if resp.status_code == 200 and resp.text.strip():
-            kos = []
-            for line in resp.text.strip().split('\n'):
-                if '\t' in line:
-                    _, ko = line.split('\t')
-                    kos.append(ko.replace('ko:', ''))
-            return kos
-    except Exception:
-        pass
+        return await asyncio.gather(*(tick(coro) for coro in coros))
+    finally:
+        progress.close()
+
+
+class KeggRestLookup:
+    """Per-entry KEGG REST lookups, memoized in a KeggCache.
+
+    prefetch() resolves every Pfam accession, then the pathways and
+    reactions of every AMG KO found, concurrently through a KeggClient;
+    the lookup methods then answer from memory. Lookups KEGG did not
+    answer resolve to nothing and are counted in `failures`.
+    """
+
+    def __init__(self, cache: KeggCache):
+        self.cache = cache
+        self.failures = 0
+        self._kos: dict[str, list[str]] = {}
+        self._pathways: dict[str, list[dict]] = {}
+        self._reactions: dict[str, list[str]] = {}
+
+    async def prefetch(self, client: KeggClient, pfam_ids: list[str]):
+        ko_lists = await gather_with_progress(
+            [get_ko_from_domain(client, pfam_id, self.cache) for pfam_id in pfam_ids],
+            "Fetching domain KOs",
+        )
+        self._kos = self._resolved(pfam_ids, ko_lists)
+
+        amg_kos = sorted({ko for kos in self._kos.values() for ko in kos if ko in AMG_ORTHOLOGS})
+        pathways, reactions = await asyncio.gather(
+            gather_with_progress([get_pathways_for_ko(client, ko, self.cache) for ko in amg_kos],
+                                 "Fetching KO pathways"),
+            gather_with_progress([get_reactions_for_ko(client, ko, self.cache) for ko in amg_kos],
+                                 "Fetching KO reactions"),
+        )
+        self._pathways = self._resolved(amg_kos, pathways)
+        self._reactions = self._resolved(amg_kos, reactions)
 
-    return []
+    def _resolved(self, keys, results: list) -> dict:
+        self.failures += sum(result is None for result in results)
+        return {key: result or [] for key, result in zip(keys, results)}
 
+    def kos(self, pfam_id: str) -> list[str]:
+        return self._kos.get(pfam_id, [])
 
-def get_pathways_for_ko(ko_id: str) -> list[dict]:
-    """Get KEGG pathways for a given KO."""
-    url = f"{KEGG_API}/link/pathway/ko:{ko_id}"
+    def pathways(self, ko_id: str) -> list[dict]:
+        return self._pathways.get(ko_id, [])
 
-    try:
-        resp = requests.get(url, timeout=30)
-        if resp.status_code == 200 and resp.text.strip():
-            pathways = []
-            for line in resp.text.strip().split('\n'):
-                if '\t' in line:
-                    _, pathway = line.split('\t')
-                    pathway_id = pathway.replace('path:', '')
-                    if pathway_id in AMG_PATHWAYS:
-                        pathways.append({
-                            'pathway_id': pathway_id,
-                            **AMG_PATHWAYS[pathway_id]
-                        })
-            return pathways
-    except Exception:
-        pass
-
-    return []
+    def reactions(self, ko_id: str) -> list[str]:
+        return self._reactions.get(ko_id, [])
+
+    def stats(self) -> str:
+        return f"KEGG lookup cache: {self.cache.stats()}, {self.failures} failed lookups"
+
+
+class KeggLinkIndex:
+    """Hash index over whole KEGG link tables.
+
+    download() fetches the pfam->ko, ko->pathway and ko->reaction tables in
+    three requests; from_snapshot() reads them from an offline snapshot with
+    no network access. Every domain is then resolved locally.
+    """
+
+    TABLES = {
+        'pfam_ko': ('ko', 'pfam'),
+        'ko_pathway': ('pathway', 'ko'),
+        'ko_reaction': ('reaction', 'ko'),
+    }
+
+    def __init__(self, links: dict, source: str = "KEGG link tables"):
+        self.links = links
+        self.source = source
+        self.failures = 0
+
+    @classmethod
+    async def download(cls, client: KeggClient) -> 'KeggLinkIndex':
+        tables = await asyncio.gather(*(
+            client.link_table(target, source, timeout=300) for target, source in cls.TABLES.values()
+        ))
+
+        links = {}
+        for (kind, (target, source)), pairs in zip(cls.TABLES.items(), tables):
+            if pairs is None:
+                raise RuntimeError(f"Could not download KEGG link table {target}/{source}")
+
+            index = defaultdict(list)
+            for entry, other in pairs:
+                index[strip_prefix(entry)].append(strip_prefix(other))
+            links[kind] = dict(index)
+            print(f"Downloaded {len(pairs)} {source}->{target} links")
+        return cls(links)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: KeggSnapshot) -> 'KeggLinkIndex':
+        missing = set(cls.TABLES) - set(snapshot.kinds())
+        if missing:
+            raise ValueError(f"KEGG snapshot {snapshot.path} lacks {', '.join(sorted(missing))}")
+        return cls(snapshot.tables(), f"KEGG snapshot {snapshot.version}")
+
+    def kos(self, pfam_id: str) -> list[str]:
+        return self.links['pfam_ko'].get(pfam_id, [])
+
+    def pathways(self, ko_id: str) -> list[dict]:
+        return amg_pathways(self.links['ko_pathway'].get(ko_id, []))
+
+    def reactions(self, ko_id: str) -> list[str]:
+        return self.links['ko_reaction'].get(ko_id, [])
+
+    def stats(self) -> str:
+        sizes = ', '.join(f"{len(index)} {kind}" for kind, index in self.links.items())
+        return f"{self.source}: {sizes}"
 
 
 def ensure_tables(db_path: str):
@@ -147,16 +298,206 @@ def ensure_tables(db_path: str):
     conn.execute("CREATE INDEX IF NOT EXISTS idx_amg_phage ON amg_annotations(phage_id)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_amg_type ON amg_annotations(amg_type)")
 
+    # Earlier runs appended duplicates; keep the first row of each AMG before adding the unique key
+    conn.execute("""
+        DELETE FROM amg_annotations WHERE id NOT IN (
+            SELECT MIN(id) FROM amg_annotations GROUP BY phage_id, gene_id, kegg_ortholog
+        )
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uniq_amg_gene_ko
+        ON amg_annotations(phage_id, gene_id, kegg_ortholog)
+    """)
+
+    # protein_domains written before InterPro entries were kept lacks interpro_id
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(protein_domains)")}
+    if columns and 'interpro_id' not in columns:
+        conn.execute("ALTER TABLE protein_domains ADD COLUMN interpro_id TEXT")
+
+    ensure_cache_table(conn)
+
     conn.commit()
     conn.close()
 
 
-def detect_amgs_from_domains(db_path: str):
-    """Detect AMGs by mapping protein domains to KEGG."""
+UPSERT_AMG_SQL = """
+    INSERT INTO amg_annotations
+    (phage_id, gene_id, locus_tag, amg_type, kegg_ortholog,
+     kegg_reaction, kegg_pathway, pathway_name, confidence, evidence)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(phage_id, gene_id, kegg_ortholog) DO UPDATE SET
+        locus_tag = excluded.locus_tag,
+        amg_type = excluded.amg_type,
+        kegg_reaction = excluded.kegg_reaction,
+        kegg_pathway = excluded.kegg_pathway,
+        pathway_name = excluded.pathway_name,
+        confidence = excluded.confidence,
+        evidence = excluded.evidence
+"""
+
+
+def is_pfam(domain_id: str, domain_type: str | None) -> bool:
+    """Whether a protein_domains row is a Pfam signature."""
+    if domain_type:
+        return domain_type.upper() == 'PFAM'
+    return bool(PFAM_ACCESSION.match(domain_id))
+
+
+def interpro_pfam_members(db_path: str) -> dict[str, list[str]]:
+    """Pfam signatures seen under each InterPro entry in protein_domains.
+
+    Only a local proxy for the entry's Pfam members: an entry's Pfam member
+    is found only if some protein in the database also hit it. Used where
+    InterPro's own mapping is not available (offline snapshots, failed lookups).
+    """
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("""
+        SELECT DISTINCT interpro_id, domain_id, domain_type FROM protein_domains
+        WHERE interpro_id IS NOT NULL AND interpro_id != ''
+    """).fetchall()
+    conn.close()
+
+    members = defaultdict(list)
+    for interpro_id, domain_id, domain_type in rows:
+        if is_pfam(domain_id, domain_type):
+            members[interpro_id].append(domain_id)
+    return dict(members)
+
+
+async def get_interpro_pfam(
+    session: aiohttp.ClientSession, interpro_id: str, cache: KeggCache,
+) -> list[str] | None:
+    """Pfam signatures integrated into an InterPro entry; None if InterPro could not be reached."""
+    members = cache.get('interpro_pfam', interpro_id)
+    if members is not None:
+        return members
+
+    members = []
+    url = INTERPRO_PFAM_MEMBERS.format(interpro_id=interpro_id)
+    try:
+        while url:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as resp:
+                # 204: the entry integrates no Pfam signature
+                if resp.status in (204, 404):
+                    break
+                if resp.status != 200:
+                    return None
+                page = await resp.json()
+            members += [result['metadata']['accession'].upper() for result in page.get('results', [])]
+            url = page.get('next')
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None
+
+    cache.put('interpro_pfam', interpro_id, members)
+    return members
+
+
+async def fetch_interpro_members(
+    cache: KeggCache, interpro_ids: list[str], ctx: PipelineContext | None = None,
+) -> tuple[dict[str, list[str]], int]:
+    """InterPro's Pfam members of each entry. Returns (members, failed lookups)."""
+    if not interpro_ids:
+        return {}, 0
+    session = ctx.http_session('interpro_api', new_session) if ctx else new_session()
+    try:
+        results = await gather_with_progress(
+            [get_interpro_pfam(session, interpro_id, cache) for interpro_id in interpro_ids],
+            "Fetching InterPro members",
+        )
+    finally:
+        if not ctx:
+            await session.close()
+
+    members = {interpro_id: result for interpro_id, result in zip(interpro_ids, results) if result is not None}
+    return members, len(interpro_ids) - len(members)
+
+
+def route_domains(domains: list, interpro_members: dict[str, list[str]]) -> tuple[dict[str, list[str]], dict[str, int]]:
+    """Choose the Pfam accessions each distinct domain is looked up through.
+
+    KEGG only links Pfam among the InterProScan libraries. Pfam hits go to
+    it directly; hits from other libraries (SMART, CDD, PANTHER, ...) go
+    through the Pfam members of their InterPro entry; the rest (no entry,
+    or an entry without a Pfam member) cannot reach a KO and are skipped.
+    Returns (domain_id -> Pfam ids, counts per route).
+    """
+    routes: dict[str, list[str]] = {}
+    counts = {'pfam': 0, 'interpro': 0, 'no_pfam': 0}
+    for domain in domains:
+        domain_id = domain['domain_id']
+        if domain_id in routes:
+            continue
+        if is_pfam(domain_id, domain['domain_type']):
+            routes[domain_id] = [domain_id]
+            counts['pfam'] += 1
+        elif interpro_members.get(domain['interpro_id'] or ''):
+            routes[domain_id] = interpro_members[domain['interpro_id']]
+            counts['interpro'] += 1
+        else:
+            routes[domain_id] = []
+            counts['no_pfam'] += 1
+    return routes, counts
+
+
+async def fetch_lookup(
+    cache: KeggCache, pfam_ids: list[str], bulk: bool, rate: float,
+    ctx: PipelineContext | None = None,
+) -> KeggRestLookup | KeggLinkIndex:
+    """Fetch everything needed to resolve `pfam_ids` from KEGG."""
+    session = ctx.http_session('kegg', new_session) if ctx else None
+    async with KeggClient(rate, session=session) as client:
+        if bulk:
+            lookup = await KeggLinkIndex.download(client)
+        else:
+            lookup = KeggRestLookup(cache)
+            await lookup.prefetch(client, pfam_ids)
+        print(client.stats())
+    return lookup
+
+
+async def refresh_snapshot(path: Path, rate: float = KEGG_RATE) -> tuple[str | None, str]:
+    """Download the KEGG link tables into a snapshot file. Returns (release, digest)."""
+    async with KeggClient(rate) as client:
+        release = await client.release()
+        index = await KeggLinkIndex.download(client)
+    return release, write_snapshot(path, index.links, release)
+
+
+def detect_amgs_from_domains(
+    db_path: str,
+    cache_ttl_days: float = DEFAULT_TTL_DAYS,
+    bulk: bool = False,
+    snapshot: KeggSnapshot | None = None,
+    rate: float = KEGG_RATE,
+    full: bool = False,
+    ctx: PipelineContext | None = None,
+):
+    """Detect AMGs by mapping protein domains to KEGG.
+
+    By default each distinct domain and KO is looked up over REST through a
+    KeggCache, so it is fetched at most once per cache_ttl_days. With bulk,
+    the whole link tables are downloaded once into a KeggLinkIndex and every
+    domain is resolved locally. With a snapshot, no network is used at all.
+    KEGG requests share one pooled KeggClient held at `rate` requests/second.
+
+    Non-Pfam domains are routed through the Pfam members of their InterPro
+    entry, taken from the InterPro API (cached alongside KEGG lookups). With
+    a snapshot, or where that lookup fails, the Pfam hits seen under the same
+    entry in protein_domains stand in for them.
+
+    Runs are incremental: only genes with protein_domains rows added since
+    the watermark in annotation_meta are re-evaluated (from all of their
+    domains), and their AMGs are replaced; AMGs of genes left without any
+    domains are dropped. With full, every gene is re-evaluated.
+    """
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
 
-    # Get all protein domains
+    row = conn.execute("SELECT value FROM annotation_meta WHERE key = ?", (AMG_WATERMARK_KEY,)).fetchone()
+    watermark = 0 if full or row is None else int(row['value'])
+    high_water = conn.execute("SELECT COALESCE(MAX(id), 0) FROM protein_domains").fetchone()[0]
+
+    # Domains of every gene that gained domain rows since the watermark
     domains = conn.execute("""
         SELECT DISTINCT
             pd.phage_id,
@@ -164,72 +505,175 @@ def detect_amgs_from_domains(db_path: str):
             pd.locus_tag,
             pd.domain_id,
             pd.domain_name,
+            pd.domain_type,
+            pd.interpro_id,
             pd.description
         FROM protein_domains pd
-        WHERE pd.domain_id IS NOT NULL
-    """).fetchall()
-
-    print(f"Checking {len(domains)} domain annotations for AMGs...")
+        WHERE pd.domain_id IS NOT NULL AND pd.id <= :high_water
+          AND (pd.id > :watermark OR pd.gene_id IN (
+              SELECT gene_id FROM protein_domains WHERE id > :watermark AND id <= :high_water
+          ))
+    """, {'watermark': watermark, 'high_water': high_water}).fetchall()
+    conn.close()
 
-    amg_count = 0
+    if watermark:
+        print(f"Checking {len(domains)} domain annotations of genes changed since domain row {watermark}...")
+    else:
+        print(f"Checking {len(domains)} domain annotations for AMGs...")
+
+    writer = BatchWriter(db_path)
+    cache = None if snapshot else KeggCache(writer, cache_ttl_days)
+
+    interpro_members = interpro_pfam_members(db_path)
+    interpro_failures = 0
+    if cache:
+        interpro_ids = sorted({
+            domain['interpro_id'] for domain in domains
+            if domain['interpro_id'] and not is_pfam(domain['domain_id'], domain['domain_type'])
+        })
+        fetched, interpro_failures = run_coroutine(fetch_interpro_members(cache, interpro_ids, ctx), ctx)
+        interpro_members.update(fetched)
+
+    routes, counts = route_domains(domains, interpro_members)
+    pfam_ids = sorted({pfam_id for pfam_ids in routes.values() for pfam_id in pfam_ids})
+    print(f"Routed {len(routes)} distinct domains: {counts['pfam']} Pfam, "
+          f"{counts['interpro']} via their InterPro entry, {counts['no_pfam']} with no Pfam route")
+    print(f"Looking up {len(pfam_ids)} Pfam accessions instead of {len(routes)} domains "
+          f"({len(routes) - len(pfam_ids)} KEGG calls avoided)")
+
+    if snapshot:
+        lookup = KeggLinkIndex.from_snapshot(snapshot)
+        source = lookup.source
+    else:
+        lookup = run_coroutine(fetch_lookup(cache, pfam_ids, bulk, rate, ctx), ctx)
+        source = "KEGG link tables" if bulk else "KEGG mapping"
+    failures = lookup.failures + interpro_failures
+
+    # (phage_id, gene_id, KO) -> AMG row; several domains of a gene may map to one KO
+    amgs: dict[tuple, dict] = {}
 
     for domain in tqdm(domains, desc="Mapping to KEGG"):
         domain_id = domain['domain_id']
 
-        # Try to get KEGG orthologs for this domain
-        kos = get_ko_from_domain(domain_id, domain['domain_name'])
-        time.sleep(REQUEST_DELAY)
+        # KEGG orthologs of the Pfam accessions this domain routes to
+        kos = dict.fromkeys(ko for pfam_id in routes[domain_id] for ko in lookup.kos(pfam_id))
 
         for ko in kos:
             # Check if this is a known AMG ortholog
             if ko in AMG_ORTHOLOGS:
+                key = (domain['phage_id'], domain['gene_id'], ko)
+                if key in amgs:
+                    amgs[key]['domains'].append(domain_id)
+                    continue
+
                 amg_info = AMG_ORTHOLOGS[ko]
 
-                # Get pathway information
-                pathways = get_pathways_for_ko(ko)
-                time.sleep(REQUEST_DELAY)
-
-                pathway_id = pathways[0]['pathway_id'] if pathways else None
-                pathway_name = pathways[0]['name'] if pathways else amg_info.get('desc', '')
-
-                conn.execute("""
-                    INSERT INTO amg_annotations
-                    (phage_id, gene_id, locus_tag, amg_type, kegg_ortholog,
-                     kegg_pathway, pathway_name, confidence, evidence)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    domain['phage_id'],
-                    domain['gene_id'],
-                    domain['locus_tag'],
-                    amg_info['type'],
-                    ko,
-                    pathway_id,
-                    pathway_name,
-                    0.8,  # High confidence for known AMG KOs
-                    json.dumps([f"Domain: {domain_id}", f"KO: {ko}"]),
-                ))
-
-                amg_count += 1
+                # Get pathway and reaction information
+                pathways = lookup.pathways(ko)
+                reactions = lookup.reactions(ko)
+
+                amgs[key] = {
+                    'locus_tag': domain['locus_tag'],
+                    'amg_type': amg_info['type'],
+                    'kegg_reaction': ','.join(reactions) or None,
+                    'kegg_pathway': pathways[0]['pathway_id'] if pathways else None,
+                    'pathway_name': pathways[0]['name'] if pathways else amg_info.get('desc', ''),
+                    'domains': [domain_id],
+                }
+
+    # Re-evaluated genes lose AMGs their current domains no longer support. If
+    # lookups failed, existing AMGs are only upserted over, never dropped.
+    if not failures:
+        if watermark:
+            writer.add_many(
+                "DELETE FROM amg_annotations WHERE gene_id = ?",
+                {(domain['gene_id'],) for domain in domains if domain['gene_id'] is not None},
+            )
+        else:
+            writer.add("DELETE FROM amg_annotations")
+
+    # Genes re-annotated to no hits lose their domain rows, so they never
+    # show up past the watermark; no domains means no AMG either way
+    writer.add("""
+        DELETE FROM amg_annotations
+        WHERE gene_id IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM protein_domains pd WHERE pd.gene_id = amg_annotations.gene_id
+        )
+    """)
 
-    conn.commit()
+    writer.add_many(UPSERT_AMG_SQL, (
+        (
+            phage_id,
+            gene_id,
+            amg['locus_tag'],
+            amg['amg_type'],
+            ko,
+            amg['kegg_reaction'],
+            amg['kegg_pathway'],
+            amg['pathway_name'],
+            0.8,  # High confidence for known AMG KOs
+            json.dumps([f"Domain: {domain_id}" for domain_id in sorted(set(amg['domains']))] + [f"KO: {ko}"]),
+        )
+        for (phage_id, gene_id, ko), amg in amgs.items()
+    ))
+    amg_count = len(amgs)
+    writer.flush()
+    total = writer.conn.execute("SELECT COUNT(*) FROM amg_annotations").fetchone()[0]
 
     # Update metadata
-    conn.execute("""
+    writer.add("""
         INSERT OR REPLACE INTO annotation_meta (key, value, updated_at)
         VALUES ('amg_last_updated', ?, ?)
-    """, (f"KEGG mapping, {amg_count} AMGs detected", int(time.time())))
-
-    conn.commit()
-    conn.close()
-
-    print(f"Detected {amg_count} AMG annotations")
+    """, (f"{source}, {total} AMGs detected", int(time.time())))
+
+    if failures:
+        # Keep the watermark so genes with unanswered lookups are retried next run
+        print(f"Warning: {lookup.failures} KEGG and {interpro_failures} InterPro lookups failed; "
+              f"watermark not advanced")
+    else:
+        writer.add("""
+            INSERT OR REPLACE INTO annotation_meta (key, value, updated_at)
+            VALUES (?, ?, ?)
+        """, (AMG_WATERMARK_KEY, str(high_water), int(time.time())))
+
+    writer.close()
+
+    print(lookup.stats())
+    print(f"Detected {amg_count} AMG annotations ({total} in total)")
     return amg_count
 
 
-def main():
+def main(argv: list[str] | None = None, ctx: PipelineContext | None = None):
     parser = argparse.ArgumentParser(description="Detect AMGs via KEGG mapping")
-    parser.add_argument("--db", required=True, help="Path to phage.db")
-    args = parser.parse_args()
+    parser.add_argument("--db", help="Path to phage.db")
+    parser.add_argument("--cache-ttl-days", type=float, default=DEFAULT_TTL_DAYS,
+                        help="Days before a cached KEGG lookup is refetched")
+    parser.add_argument("--bulk", action="store_true",
+                        help="Download whole KEGG link tables once instead of per-domain lookups")
+    parser.add_argument("--snapshot", help="Resolve domains from an offline KEGG snapshot file (no network)")
+    parser.add_argument("--refresh-snapshot", metavar="PATH",
+                        help="Download the KEGG link tables into a snapshot file and exit")
+    parser.add_argument("--rate", type=float, default=KEGG_RATE,
+                        help="Maximum KEGG requests per second")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-evaluate every gene instead of only those changed since the last run")
+    args = parser.parse_args(argv)
+
+    if args.refresh_snapshot:
+        release, digest = asyncio.run(refresh_snapshot(Path(args.refresh_snapshot), args.rate))
+        print(f"Wrote KEGG snapshot {args.refresh_snapshot} (release {release or 'unknown'}, digest {digest[:12]})")
+        return 0
+
+    if not args.db:
+        parser.error("--db is required unless --refresh-snapshot is given")
+
+    snapshot = None
+    if args.snapshot:
+        try:
+            snapshot = KeggSnapshot(Path(args.snapshot))
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Error: {e}")
+            return 1
 
     db_path = Path(args.db)
     if not db_path.exists():
@@ -237,7 +681,7 @@ def main():
         return 1
 
     ensure_tables(str(db_path))
-    detect_amgs_from_domains(str(db_path))
+    detect_amgs_from_domains(str(db_path), args.cache_ttl_days, args.bulk, snapshot, args.rate, args.full, ctx)
 
     return 0
 
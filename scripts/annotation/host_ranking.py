@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Phage-to-Host Ranking by Codon Adaptation
+
+Ranks, for every phage, the hosts in host_trna_pools its genes are best
+adapted to. Each phage's CDS codon counts are summed into one 64-element
+vector (from the stored codon matrices), so scoring all phages against
+all hosts is one phages x 64 by 64 x hosts matrix product. The top-k
+hosts per phage are picked with a partial sort and stored in
+host_rankings.
+
+Phages are scored in blocks of BLOCK_PHAGES rows, which keeps memory
+bounded for thousands of phages x thousands of hosts.
+
+Usage:
+    python codon_matrix.py --db phage.db
+    python host_ranking.py --db phage.db [--top-k 10] [--metric tai|tai_family]
+"""
+
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+
+from codon_adaptation import FAMILY_CODONS, TAI_CODONS, relative_weights
+from db_writer import BatchWriter
+from host_trna_data import ensure_tables, load_scoring_inputs
+from pipeline_context import PipelineContext, connect
+
+DEFAULT_TOP_K = 10
+BLOCK_PHAGES = 1024
+
+INSERT_RANKING_SQL = """
+    INSERT INTO host_rankings (phage_id, metric, rank, host_name, score, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def ensure_ranking_table(conn: sqlite3.Connection):
+    """Create the host_rankings table if it does not exist."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS host_rankings (
+            phage_id INTEGER NOT NULL,
+            metric TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            host_name TEXT NOT NULL,
+            score REAL NOT NULL,
+            created_at INTEGER,
+            PRIMARY KEY (phage_id, metric, rank)
+        )
+    """)
+    conn.commit()
+
+
+def phage_codon_totals(conn: sqlite3.Connection) -> tuple[list[int], np.ndarray]:
+    """(phage ids, phages x 64 codon counts summed over each phage's CDSs)."""
+    phage_ids = []
+    totals = []
+    for phage_id, gene_count, counts in conn.execute(
+        "SELECT phage_id, gene_count, counts FROM gene_codon_matrix ORDER BY phage_id"
+    ):
+        phage_ids.append(phage_id)
+        totals.append(np.frombuffer(counts, dtype='<u4').reshape(gene_count, 64).sum(axis=0))
+    return phage_ids, np.array(totals, dtype=float).reshape(len(phage_ids), 64)
+
+
+def top_hosts(counts: np.ndarray, log_weights: np.ndarray, mask: np.ndarray, k: int):
+    """Indices and scores of the k best hosts for every row of counts, best first."""
+    used = counts[:, mask]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = np.exp(used @ log_weights[:, mask].T / used.sum(axis=1, keepdims=True))
+    scores = np.nan_to_num(scores, nan=-np.inf)
+
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def rank_hosts(db_path: str, top_k: int = DEFAULT_TOP_K, metric: str = 'tai', ctx: PipelineContext | None = None):
+    """Replace host_rankings for `metric` with the top-k hosts of every phage."""
+    writer = BatchWriter(db_path)
+    conn = connect(db_path, ctx)
+    ensure_ranking_table(conn)
+
+    inputs = load_scoring_inputs(writer, conn)
+    if inputs is None:
+        conn.close()
+        writer.close()
+        return
+    _, hosts, weights = inputs
+
+    started = time.monotonic()
+    log_tai, log_family = relative_weights(weights)
+    log_weights, mask = (log_tai, TAI_CODONS) if metric == 'tai' else (log_family, FAMILY_CODONS)
+
+    phage_ids, totals = phage_codon_totals(conn)
+    conn.close()
+
+    writer.add("DELETE FROM host_rankings WHERE metric = ?", (metric,))
+    now = int(time.time())
+    for block in range(0, len(phage_ids), BLOCK_PHAGES):
+        top, scores = top_hosts(totals[block:block + BLOCK_PHAGES], log_weights, mask, top_k)
+        writer.add_many(INSERT_RANKING_SQL, (
+            (phage_ids[block + i], metric, rank + 1, hosts[h], float(score), now)
+            for i in range(len(top))
+            for rank, (h, score) in enumerate(zip(top[i].tolist(), scores[i].tolist()))
+            if np.isfinite(score)
+        ))
+    elapsed = time.monotonic() - started
+
+    writer.add("""
+        INSERT OR REPLACE INTO annotation_meta (key, value, updated_at)
+        VALUES ('host_ranking_updated', ?, ?)
+    """, (f"{len(phage_ids)} phages x {len(hosts)} hosts, top {top_k} by {metric}", int(time.time())))
+    writer.close()
+
+    print(f"Ranked {len(hosts)} hosts for {len(phage_ids)} phages by {metric} "
+          f"(top {top_k}, {elapsed:.2f}s)")
+
+
+def main(argv: list[str] | None = None, ctx: PipelineContext | None = None):
+    parser = argparse.ArgumentParser(description="Rank hosts for every phage by codon adaptation")
+    parser.add_argument("--db", required=True, help="Path to phage.db")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="Hosts kept per phage")
+    parser.add_argument("--metric", choices=['tai', 'tai_family'], default='tai', help="Adaptation index to rank by")
+    args = parser.parse_args(argv)
+
+    db_path = Path(args.db)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        return 1
+
+    ensure_tables(str(db_path))
+    rank_hosts(str(db_path), args.top_k, args.metric, ctx)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
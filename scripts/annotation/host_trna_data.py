@@ -5,19 +5,31 @@ Host tRNA Pool Data
 Contains pre-curated tRNA copy numbers for common bacterial hosts.
 Data sourced from GtRNAdb (http://gtrnadb.ucsc.edu/) and literature.
 
+Each host's pool is also compiled into a 64-codon weight vector with
+wobble pairing applied (the W_i of dos Reis et al. 2004) and stored in
+host_codon_weights, keyed by a hash of the host's tRNA rows. Consumers
+read the compiled vectors; a host is only recompiled when its rows change.
+
 Usage:
     python host_trna_data.py --db phage.db
 """
 
 import argparse
-import json
+import hashlib
 import sqlite3
 import time
 from pathlib import Path
 
+import numpy as np
+
+from codon_matrix import stored_matrix_count
+from db_writer import BatchWriter
+from pipeline_context import PipelineContext
+from sequence_utils import CODONS
+
 # tRNA copy numbers for common hosts
 # Format: anticodon -> (amino_acid, codon, copy_number)
-# Wobble pairing is handled by the codon adaptation calculator
+# Wobble pairing is applied when pools are compiled (compile_host_weights)
 
 HOST_TRNA_DATA = {
     "Escherichia coli K-12": {
@@ -179,6 +191,124 @@ HOST_TRNA_DATA = {
     },
 }
 
+# Selective constraints s of anticodon position 34 : codon position 3 pairs
+# (dos Reis et al. 2004). Watson-Crick pairs have s = 0; an A at position
+# 34 is read as inosine, as it is edited in the tRNA.
+S_VALUES = {
+    ('T', 'A'): 0.0, ('C', 'G'): 0.0, ('G', 'C'): 0.0,
+    ('I', 'T'): 0.0, ('I', 'C'): 0.28, ('I', 'A'): 0.9999,
+    ('G', 'T'): 0.41,
+    ('T', 'G'): 0.68,
+}
+
+# Bump when the compilation rules change so stored vectors are recompiled
+WEIGHTS_VERSION = 1
+
+COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+
+
+def decoded_codons(anticodon: str) -> list[tuple[str, float]]:
+    """Codons read by a tRNA, with the s-value of each pairing.
+
+    anticodon is given 5'->3' as DNA (positions 34, 35, 36); U is accepted
+    for T.
+    """
+    anticodon = anticodon.upper().replace('U', 'T')
+    if len(anticodon) != 3 or any(base not in COMPLEMENT for base in anticodon):
+        return []
+
+    # Positions 36 and 35 pair with codon positions 1 and 2 exactly
+    prefix = COMPLEMENT[anticodon[2]] + COMPLEMENT[anticodon[1]]
+    wobble = 'I' if anticodon[0] == 'A' else anticodon[0]
+    return [
+        (prefix + third, s)
+        for (base, third), s in S_VALUES.items()
+        if base == wobble
+    ]
+
+
+def host_data_hash(rows: list[tuple[str, int]]) -> str:
+    """Hash of a host's (anticodon, copy_number) rows and the compilation rules."""
+    digest = hashlib.sha256(f"v{WEIGHTS_VERSION}\n".encode())
+    for anticodon, copy_number in sorted(rows):
+        digest.update(f"{anticodon}\t{copy_number}\n".encode())
+    return digest.hexdigest()
+
+
+def codon_weights(rows: list[tuple[str, int]]) -> np.ndarray:
+    """Absolute adaptiveness W_i = sum of (1 - s) * copy number over the tRNAs reading codon i."""
+    codon_index = {codon: i for i, codon in enumerate(CODONS)}
+    weights = np.zeros(64)
+    for anticodon, copy_number in rows:
+        for codon, s in decoded_codons(anticodon):
+            weights[codon_index[codon]] += (1 - s) * (copy_number or 0)
+    return weights
+
+
+def compile_host_weights(writer: BatchWriter) -> tuple[int, int]:
+    """Compile host_trna_pools into host_codon_weights.
+
+    Only hosts whose tRNA rows changed since they were last compiled are
+    recompiled; hosts no longer in host_trna_pools are dropped. Returns
+    (compiled, unchanged) host counts.
+    """
+    writer.flush()
+    conn = writer.conn
+    pools: dict[str, list[tuple[str, int]]] = {}
+    for host_name, anticodon, copy_number in conn.execute(
+        "SELECT host_name, anticodon, copy_number FROM host_trna_pools"
+    ):
+        pools.setdefault(host_name, []).append((anticodon, copy_number))
+
+    stored = dict(conn.execute("SELECT host_name, data_hash FROM host_codon_weights"))
+
+    compiled = 0
+    now = int(time.time())
+    for host_name, rows in pools.items():
+        data_hash = host_data_hash(rows)
+        if stored.get(host_name) == data_hash:
+            continue
+        writer.add("""
+            INSERT OR REPLACE INTO host_codon_weights (host_name, data_hash, weights, compiled_at)
+            VALUES (?, ?, ?, ?)
+        """, (host_name, data_hash, codon_weights(rows).astype('<f8').tobytes(), now))
+        compiled += 1
+
+    writer.add_many(
+        "DELETE FROM host_codon_weights WHERE host_name = ?",
+        ((host_name,) for host_name in stored if host_name not in pools),
+    )
+    writer.flush()
+    return compiled, len(pools) - compiled
+
+
+def load_host_weights(conn: sqlite3.Connection) -> tuple[list[str], np.ndarray]:
+    """Compiled weights of every host, as (host names, hosts x 64 matrix)."""
+    rows = conn.execute("SELECT host_name, weights FROM host_codon_weights ORDER BY host_name").fetchall()
+    hosts = [row[0] for row in rows]
+    weights = np.array([np.frombuffer(row[1], dtype='<f8') for row in rows]).reshape(len(rows), 64)
+    return hosts, weights
+
+
+def load_scoring_inputs(writer: BatchWriter, conn: sqlite3.Connection) -> tuple[int, list[str], np.ndarray] | None:
+    """Inputs of the codon scoring steps: (phages with codon matrices, host names, hosts x 64 weights).
+
+    Host weights are recompiled first, a no-op unless host_trna_pools
+    changed. Returns None, after naming the step to run, if codon matrices
+    or host weights are missing.
+    """
+    phage_count = stored_matrix_count(conn)
+    if not phage_count:
+        print("No codon matrices found - run codon_matrix.py first")
+        return None
+
+    compile_host_weights(writer)
+    hosts, weights = load_host_weights(conn)
+    if not hosts:
+        print("No host tRNA data found - run host_trna_data.py first")
+        return None
+    return phage_count, hosts, weights
+
 
 def ensure_tables(db_path: str):
     """Ensure host tRNA tables exist."""
@@ -200,51 +330,122 @@ def ensure_tables(db_path: str):
     conn.execute("CREATE INDEX IF NOT EXISTS idx_trna_host ON host_trna_pools(host_name)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_trna_anticodon ON host_trna_pools(anticodon)")
 
+    # One row per host in host_trna_pools, with the hash of its pool
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS host_trna_hosts (
+            host_name TEXT PRIMARY KEY,
+            host_tax_id INTEGER,
+            data_hash TEXT NOT NULL,
+            trna_count INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS host_codon_weights (
+            host_name TEXT PRIMARY KEY,
+            data_hash TEXT NOT NULL,
+            weights BLOB NOT NULL,
+            compiled_at INTEGER NOT NULL
+        )
+    """)
+
     conn.commit()
     conn.close()
 
 
-def load_trna_data(db_path: str):
-    """Load host tRNA data into the database."""
-    conn = sqlite3.connect(db_path)
+INSERT_TRNA_SQL = """
+    INSERT INTO host_trna_pools
+    (host_name, host_tax_id, anticodon, amino_acid, codon, copy_number, relative_abundance)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
 
-    # Clear existing data
-    conn.execute("DELETE FROM host_trna_pools")
 
-    for host_name, host_data in HOST_TRNA_DATA.items():
-        tax_id = host_data["tax_id"]
-        trnas = host_data["trnas"]
+def pool_hash(tax_id: int | None, trnas: dict[str, tuple[str, str, int]]) -> str:
+    """Content hash of one host's tRNA pool."""
+    digest = hashlib.sha256(f"{tax_id}\n".encode())
+    for anticodon in sorted(trnas):
+        amino_acid, codon, copy_number = trnas[anticodon]
+        digest.update(f"{anticodon}\t{amino_acid}\t{codon}\t{copy_number}\n".encode())
+    return digest.hexdigest()
 
-        # Calculate total copy numbers for relative abundance
-        total_copies = sum(t[2] for t in trnas.values())
 
-        for anticodon, (amino_acid, codon, copy_number) in trnas.items():
-            relative_abundance = copy_number / total_copies if total_copies > 0 else 0
+def stored_pool_hashes(conn: sqlite3.Connection) -> dict[str, str]:
+    """Content hash of every host whose stored pool rows are still intact.
 
-            conn.execute("""
-                INSERT INTO host_trna_pools
-                (host_name, host_tax_id, anticodon, amino_acid, codon, copy_number, relative_abundance)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (host_name, tax_id, anticodon, amino_acid, codon, copy_number, relative_abundance))
+    A host whose rows in host_trna_pools are missing or no longer add up to
+    its recorded copy number (e.g. after a database rebuild dropped the
+    pools) is left out, so its next upsert rewrites it.
+    """
+    return dict(conn.execute("""
+        SELECT h.host_name, h.data_hash FROM host_trna_hosts h
+        JOIN (
+            SELECT host_name, SUM(copy_number) AS copies FROM host_trna_pools GROUP BY host_name
+        ) p ON p.host_name = h.host_name
+        WHERE p.copies = h.trna_count
+    """))
 
-    conn.commit()
+
+def upsert_host_pool(
+    writer: BatchWriter,
+    host_name: str,
+    tax_id: int | None,
+    trnas: dict[str, tuple[str, str, int]],
+    stored: dict[str, str],
+) -> bool:
+    """Replace one host's rows in host_trna_pools unless its content is unchanged.
+
+    trnas maps anticodon -> (amino_acid, codon, copy_number), as in
+    HOST_TRNA_DATA; stored is stored_pool_hashes(), updated in place.
+    Returns True if the host was written.
+    """
+    data_hash = pool_hash(tax_id, trnas)
+    if stored.get(host_name) == data_hash:
+        return False
+
+    total_copies = sum(t[2] for t in trnas.values())
+    writer.add("DELETE FROM host_trna_pools WHERE host_name = ?", (host_name,))
+    writer.add_many(INSERT_TRNA_SQL, (
+        (host_name, tax_id, anticodon, amino_acid, codon, copy_number,
+         copy_number / total_copies if total_copies > 0 else 0)
+        for anticodon, (amino_acid, codon, copy_number) in trnas.items()
+    ))
+    writer.add("""
+        INSERT OR REPLACE INTO host_trna_hosts (host_name, host_tax_id, data_hash, trna_count, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, (host_name, tax_id, data_hash, total_copies, int(time.time())))
+    stored[host_name] = data_hash
+    return True
+
+
+def load_trna_data(db_path: str):
+    """Load host tRNA data into the database."""
+    writer = BatchWriter(db_path)
+    stored = stored_pool_hashes(writer.conn)
+
+    # Curated hosts are upserted; hosts imported from GtRNAdb are left alone
+    changed = sum(
+        upsert_host_pool(writer, host_name, host_data["tax_id"], host_data["trnas"], stored)
+        for host_name, host_data in HOST_TRNA_DATA.items()
+    )
 
     # Update metadata
-    conn.execute("""
+    writer.add("""
         INSERT OR REPLACE INTO annotation_meta (key, value, updated_at)
         VALUES ('trna_data_loaded', ?, ?)
     """, (f"{len(HOST_TRNA_DATA)} hosts loaded", int(time.time())))
 
-    conn.commit()
-    conn.close()
+    compiled, unchanged = compile_host_weights(writer)
+    writer.close()
 
-    print(f"Loaded tRNA data for {len(HOST_TRNA_DATA)} hosts")
+    print(f"Loaded tRNA data for {len(HOST_TRNA_DATA)} hosts ({changed} changed)")
+    print(f"Compiled codon weights for {compiled} hosts ({unchanged} unchanged)")
 
 
-def main():
+def main(argv: list[str] | None = None, ctx: PipelineContext | None = None):
     parser = argparse.ArgumentParser(description="Load host tRNA pool data")
     parser.add_argument("--db", required=True, help="Path to phage.db")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     db_path = Path(args.db)
     if not db_path.exists():
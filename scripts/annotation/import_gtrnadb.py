@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+GtRNAdb / tRNAscan-SE Host tRNA Importer
+
+Builds host tRNA pools from tRNAscan-SE output for any number of host
+genomes and upserts them into host_trna_pools. Files are read line by
+line; only per-anticodon gene counts are kept in memory, one host at a
+time. Each host is written only if its pool differs from the stored one
+(by content hash), and codon weights are recompiled only for the hosts
+that changed.
+
+Accepted inputs (optionally gzipped), one or more per host:
+    *.out, *.txt   tRNAscan-SE tabular output (as published by GtRNAdb)
+    *.fa, *.fasta  GtRNAdb tRNA FASTA (headers like ">..._tRNA-Ala-GGC-1-1 ...")
+
+The host name is the file name up to the first '.' (with '_' read as a
+space), unless --host-map maps the file stem to a name and tax id.
+Pseudogenes and undetermined or suppressor tRNAs are skipped.
+
+Usage:
+    python import_gtrnadb.py --db phage.db trnas/*.out.gz
+    python import_gtrnadb.py --db phage.db trnas/ --host-map hosts.tsv
+"""
+
+import argparse
+import gzip
+import re
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Iterator
+
+from tqdm import tqdm
+
+from db_writer import BatchWriter
+from host_trna_data import compile_host_weights, ensure_tables, stored_pool_hashes, upsert_host_pool
+from pipeline_context import PipelineContext
+from sequence_utils import reverse_complement
+
+TRNA_SUFFIXES = {'.out', '.txt', '.fa', '.fasta', '.fna'}
+
+AMINO_ACIDS = {
+    'Ala': 'A', 'Arg': 'R', 'Asn': 'N', 'Asp': 'D', 'Cys': 'C',
+    'Gln': 'Q', 'Glu': 'E', 'Gly': 'G', 'His': 'H', 'Ile': 'I',
+    'Ile2': 'I', 'Leu': 'L', 'Lys': 'K', 'Met': 'M', 'fMet': 'M',
+    'iMet': 'M', 'Phe': 'F', 'Pro': 'P', 'Ser': 'S', 'Thr': 'T',
+    'Trp': 'W', 'Tyr': 'Y', 'Val': 'V',
+}
+
+GTRNADB_HEADER = re.compile(r'tRNA-(\w+?)-([ACGTUN]{3})-\d+')
+
+
+def anticodon_key(isotype: str, anticodon: str) -> str | None:
+    """Normalized anticodon for a tRNA gene, or None if it should be skipped."""
+    anticodon = anticodon.upper().replace('U', 'T')
+    if isotype not in AMINO_ACIDS or not re.fullmatch(r'[ACGT]{3}', anticodon):
+        return None
+    # Lysidine-modified tRNA-Ile2 (CAT) reads ATA; HOST_TRNA_DATA records
+    # that tRNA under the equivalent anticodon TAT
+    if isotype == 'Ile2' and anticodon == 'CAT':
+        return 'TAT'
+    return anticodon
+
+
+def open_text(path: Path):
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rt')
+    return open(path)
+
+
+def base_suffix(path: Path) -> str:
+    return Path(path.stem).suffix if path.suffix == '.gz' else path.suffix
+
+
+def iter_trnascan(f) -> Iterator[tuple[str, str]]:
+    """(isotype, anticodon) of each tRNA in tRNAscan-SE tabular output."""
+    for line in f:
+        fields = line.rstrip('\n').split('\t')
+        # Header lines have a non-numeric tRNA number
+        if len(fields) < 6 or not fields[1].strip().isdigit():
+            continue
+        if 'pseudo' in line.lower():
+            continue
+        yield fields[4].strip(), fields[5].strip()
+
+
+def iter_gtrnadb_fasta(f) -> Iterator[tuple[str, str]]:
+    """(isotype, anticodon) of each tRNA in a GtRNAdb FASTA file."""
+    for line in f:
+        if not line.startswith('>'):
+            continue
+        match = GTRNADB_HEADER.search(line)
+        if match and 'pseudo' not in line.lower():
+            yield match.group(1), match.group(2)
+
+
+def count_anticodons(path: Path, counts: Counter, amino_acids: dict[str, str]) -> int:
+    """Add one file's tRNA genes to counts; returns how many genes were skipped."""
+    parse = iter_gtrnadb_fasta if base_suffix(path) in {'.fa', '.fasta', '.fna'} else iter_trnascan
+    skipped = 0
+    with open_text(path) as f:
+        for isotype, anticodon in parse(f):
+            key = anticodon_key(isotype, anticodon)
+            if key is None:
+                skipped += 1
+                continue
+            counts[key] += 1
+            amino_acids.setdefault(key, AMINO_ACIDS[isotype])
+    return skipped
+
+
+def host_from_path(path: Path) -> str:
+    return path.name.split('.')[0].replace('_', ' ')
+
+
+def load_host_map(path: Path) -> dict[str, tuple[str, int | None]]:
+    """Read a TSV of file stem -> (host name, tax id)."""
+    hosts = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 2 or line.startswith('#'):
+                continue
+            tax_id = int(fields[2]) if len(fields) > 2 and fields[2].strip().isdigit() else None
+            hosts[fields[0]] = (fields[1], tax_id)
+    return hosts
+
+
+def collect_files(paths: list[str]) -> list[Path]:
+    """Expand directories into the tRNA files they contain."""
+    files = []
+    for p in map(Path, paths):
+        candidates = sorted(p.iterdir()) if p.is_dir() else [p]
+        files.extend(c for c in candidates if c.is_file() and base_suffix(c) in TRNA_SUFFIXES)
+    return files
+
+
+def import_pools(db_path: str, files: list[Path], host_map: dict[str, tuple[str, int | None]]):
+    """Stream tRNA files into per-host pools and upsert the hosts that changed."""
+    by_host: dict[str, list[Path]] = defaultdict(list)
+    tax_ids: dict[str, int | None] = {}
+    for path in files:
+        host_name, tax_id = host_map.get(path.name.split('.')[0], (host_from_path(path), None))
+        by_host[host_name].append(path)
+        tax_ids[host_name] = tax_id
+
+    writer = BatchWriter(db_path)
+    stored = stored_pool_hashes(writer.conn)
+
+    changed = unchanged = empty = skipped = 0
+    for host_name, paths in tqdm(by_host.items(), desc="Importing tRNA pools"):
+        counts: Counter = Counter()
+        amino_acids: dict[str, str] = {}
+        for path in paths:
+            skipped += count_anticodons(path, counts, amino_acids)
+        if not counts:
+            empty += 1
+            continue
+
+        trnas = {
+            anticodon: (amino_acids[anticodon], reverse_complement(anticodon), copy_number)
+            for anticodon, copy_number in counts.items()
+        }
+        if upsert_host_pool(writer, host_name, tax_ids[host_name], trnas, stored):
+            changed += 1
+        else:
+            unchanged += 1
+
+    writer.add("""
+        INSERT OR REPLACE INTO annotation_meta (key, value, updated_at)
+        VALUES ('trna_import', ?, ?)
+    """, (f"{changed + unchanged} hosts from {len(files)} files", int(time.time())))
+
+    compiled, _ = compile_host_weights(writer)
+    writer.close()
+
+    print(f"Imported {changed + unchanged} hosts: {changed} changed, {unchanged} unchanged")
+    if empty:
+        print(f"   {empty} hosts had no usable tRNA genes")
+    if skipped:
+        print(f"   {skipped} undetermined/suppressor tRNA genes skipped")
+    print(f"   Compiled codon weights for {compiled} hosts")
+
+
+def main(argv: list[str] | None = None, ctx: PipelineContext | None = None):
+    parser = argparse.ArgumentParser(description="Import host tRNA pools from GtRNAdb / tRNAscan-SE output")
+    parser.add_argument("--db", required=True, help="Path to phage.db")
+    parser.add_argument("paths", nargs='+', help="tRNAscan-SE .out or GtRNAdb FASTA files, or directories of them")
+    parser.add_argument("--host-map", help="TSV of file stem, host name and tax id")
+    args = parser.parse_args(argv)
+
+    db_path = Path(args.db)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        return 1
+
+    files = collect_files(args.paths)
+    if not files:
+        print("Error: No tRNA files found")
+        return 1
+
+    host_map = load_host_map(Path(args.host_map)) if args.host_map else {}
+
+    ensure_tables(str(db_path))
+    import_pools(str(db_path), files, host_map)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
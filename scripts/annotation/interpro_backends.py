@@ -0,0 +1,821 @@
+#!/usr/bin/env python3
+"""
+InterProScan Backends
+
+Ways of running InterProScan behind one interface, so the annotation
+workflow does not care where the jobs execute:
+
+    RemoteBackend   EBI's iprscan5 REST service, one job per protein,
+                    journaled and polled on adaptive schedules
+    LocalBackend    a locally installed interproscan.sh, run over sharded
+                    multi-FASTA batches by a pool of worker processes
+
+Both hand back domain records in the shape produced by
+parse_interpro_result(). The streaming output parsers here also read the
+JSON and TSV files written by interproscan.sh.
+
+Usage:
+    async with RemoteBackend(writer, email) as backend:
+        status, domains, version, job_id = await backend.annotate(group)
+        # ... queue the group's domain and status rows, then:
+        backend.finished(job_id, status)
+"""
+
+import asyncio
+import gzip
+import heapq
+import json
+import re
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from itertools import count
+from pathlib import Path
+from typing import IO, Iterator
+
+import aiohttp
+
+from db_writer import BatchWriter
+from interpro_cache import protein_hash
+from pipeline_context import PipelineContext
+
+# InterProScan REST API endpoints
+INTERPRO_SUBMIT = "https://www.ebi.ac.uk/Tools/services/rest/iprscan5/run"
+INTERPRO_STATUS = "https://www.ebi.ac.uk/Tools/services/rest/iprscan5/status/{job_id}"
+INTERPRO_RESULT = "https://www.ebi.ac.uk/Tools/services/rest/iprscan5/result/{job_id}/json"
+
+# Rate limiting
+REQUEST_DELAY = 1.0  # seconds between job submissions
+MAX_RETRIES = 3
+
+# Adaptive polling (see PollScheduler)
+DEFAULT_JOB_SECONDS = 90  # expected run time before any job has been observed
+MIN_POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 120
+POLL_BACKOFF = 1.5
+
+# Concurrency limits (EBI asks for no more than 30 concurrent jobs per user)
+MAX_JOBS_IN_FLIGHT = 25
+MAX_CONCURRENT_REQUESTS = 5
+
+FAILED_STATUSES = ('FAILURE', 'ERROR', 'NOT_FOUND')
+
+# EBI keeps job results for 7 days; older journaled jobs are not resumed
+JOB_RETENTION_DAYS = 7
+
+# Local interproscan.sh runs
+DEFAULT_INTERPROSCAN = "interproscan.sh"
+DEFAULT_SHARD_SIZE = 100  # proteins per multi-FASTA batch
+DEFAULT_LOCAL_WORKERS = 2
+DEFAULT_LOCAL_CPU = 4
+DEFAULT_SHARD_SECONDS = 300  # expected run time before any shard has been observed
+
+
+class RequestLimiter:
+    """Caps concurrent HTTP requests and spaces job submissions.
+
+    EBI asks clients to keep requests modest and to pause between
+    submissions, so starts of ``submit`` calls are spaced by REQUEST_DELAY
+    while status/result calls only share the concurrency cap.
+    """
+
+    def __init__(self, max_requests: int = MAX_CONCURRENT_REQUESTS, submit_delay: float = REQUEST_DELAY):
+        self._requests = asyncio.Semaphore(max_requests)
+        self._submit_lock = asyncio.Lock()
+        self._submit_delay = submit_delay
+        self._last_submit = 0.0
+
+    @asynccontextmanager
+    async def request(self, submit: bool = False):
+        if submit:
+            async with self._submit_lock:
+                wait = self._last_submit + self._submit_delay - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._last_submit = time.monotonic()
+
+        async with self._requests:
+            yield
+
+
+async def submit_interpro_job(
+    session: aiohttp.ClientSession,
+    limiter: RequestLimiter,
+    sequence: str,
+    email: str = "phage-explorer@example.com",
+) -> str:
+    """Submit a sequence to InterProScan and return job ID."""
+    data = {
+        'email': email,
+        'sequence': sequence,
+        'goterms': 'false',
+        'pathways': 'false',
+    }
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            async with limiter.request(submit=True):
+                async with session.post(INTERPRO_SUBMIT, data=data, timeout=aiohttp.ClientTimeout(total=60)) as resp:
+                    resp.raise_for_status()
+                    return (await resp.text()).strip()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt < MAX_RETRIES - 1:
+                await asyncio.sleep(REQUEST_DELAY * (attempt + 1))
+            else:
+                raise RuntimeError(f"Failed to submit job: {e}")
+
+    return ""
+
+
+async def check_job_status(session: aiohttp.ClientSession, limiter: RequestLimiter, job_id: str) -> str:
+    """Check InterProScan job status."""
+    url = INTERPRO_STATUS.format(job_id=job_id)
+    async with limiter.request():
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as resp:
+            resp.raise_for_status()
+            return (await resp.text()).strip()
+
+
+async def get_job_result(session: aiohttp.ClientSession, limiter: RequestLimiter, job_id: str) -> dict:
+    """Get InterProScan results as JSON."""
+    url = INTERPRO_RESULT.format(job_id=job_id)
+    async with limiter.request():
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=60)) as resp:
+            resp.raise_for_status()
+            return await resp.json(content_type=None)
+
+
+class CompletionModel:
+    """Expected InterProScan run time as a function of protein length.
+
+    Keeps the mean observed duration per length bucket, falling back to the
+    overall mean and then to DEFAULT_JOB_SECONDS before anything is observed.
+    """
+
+    BUCKET_SIZE = 250  # residues
+
+    def __init__(self):
+        self._totals: dict[int, float] = defaultdict(float)
+        self._counts: dict[int, int] = defaultdict(int)
+
+    def _bucket(self, length: int) -> int:
+        return min(length // self.BUCKET_SIZE, 8)
+
+    def observe(self, length: int, seconds: float):
+        bucket = self._bucket(length)
+        self._totals[bucket] += seconds
+        self._counts[bucket] += 1
+
+    def expected(self, length: int | None = None) -> float:
+        if length is not None:
+            bucket = self._bucket(length)
+            if self._counts[bucket]:
+                return self._totals[bucket] / self._counts[bucket]
+        count = sum(self._counts.values())
+        if count:
+            return sum(self._totals.values()) / count
+        return DEFAULT_JOB_SECONDS
+
+
+class PollScheduler:
+    """Priority-queue poller that checks each job on its own schedule.
+
+    A job's first status check is due when the completion model expects it
+    to finish. While it keeps running, the interval grows by POLL_BACKOFF
+    from a quarter of that expectation, bounded by MIN/MAX_POLL_INTERVAL.
+    Finished jobs feed their duration back into the model.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, limiter: RequestLimiter, model: CompletionModel):
+        self.session = session
+        self.limiter = limiter
+        self.model = model
+        self.status_checks = 0
+        self._queue: list[tuple[float, int, dict]] = []
+        self._counter = count()
+        self._wakeup = asyncio.Event()
+        self._watched: dict[str, dict] = {}
+
+    def watch(self, job_id: str, length: int, submitted_at: float | None = None) -> asyncio.Future:
+        """Schedule a job and return a future resolved with its terminal status."""
+        submitted_at = submitted_at or time.time()
+        expected = self.model.expected(length)
+        job = {
+            'job_id': job_id,
+            'length': length,
+            'submitted_at': submitted_at,
+            'expected_at': submitted_at + expected,
+            'interval': min(max(expected / 4, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL),
+            'future': asyncio.get_running_loop().create_future(),
+        }
+        self._watched[job_id] = job
+        self._push(job, max(job['expected_at'], time.time() + MIN_POLL_INTERVAL))
+        return job['future']
+
+    def _push(self, job: dict, due: float):
+        heapq.heappush(self._queue, (due, next(self._counter), job))
+        self._wakeup.set()
+
+    def remaining_seconds(self) -> float:
+        """Expected time until every watched job has finished."""
+        now = time.time()
+        return max((max(job['expected_at'], now) - now for job in self._watched.values()), default=0.0)
+
+    async def _check(self, job: dict):
+        try:
+            status = await check_job_status(self.session, self.limiter, job['job_id'])
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error checking {job['job_id']}: {e}")
+            status = None
+        self.status_checks += 1
+
+        if status == 'FINISHED' or status in FAILED_STATUSES:
+            del self._watched[job['job_id']]
+            if status == 'FINISHED':
+                self.model.observe(job['length'], time.time() - job['submitted_at'])
+            job['future'].set_result(status)
+            return
+
+        # Still running (or unreachable): back off and push the estimate out
+        now = time.time()
+        job['expected_at'] = max(job['expected_at'], now + job['interval'])
+        self._push(job, now + job['interval'])
+        job['interval'] = min(job['interval'] * POLL_BACKOFF, MAX_POLL_INTERVAL)
+
+    async def run(self):
+        """Poll due jobs forever; cancel the task to stop."""
+        checks = set()
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self._queue[0][0] - time.time()
+            if delay > 0:
+                # Sleep until the earliest job is due or a new job is scheduled
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, job = heapq.heappop(self._queue)
+            task = asyncio.create_task(self._check(job))
+            checks.add(task)
+            task.add_done_callback(checks.discard)
+
+
+def parse_interpro_result(result: dict) -> list[dict]:
+    """Parse InterProScan JSON result into domain records."""
+    domains = []
+
+    for seq_result in result.get('results', []):
+        for match in seq_result.get('matches', []):
+            signature = match.get('signature', {})
+            entry = signature.get('entry') or {}
+
+            for location in match.get('locations', []):
+                domain = {
+                    'domain_id': signature.get('accession', ''),
+                    'domain_name': signature.get('name', ''),
+                    'domain_type': signature.get('signatureLibraryRelease', {}).get('library', ''),
+                    'start': location.get('start', 0),
+                    'end': location.get('end', 0),
+                    'score': location.get('score', 0.0),
+                    'e_value': location.get('evalue', 1.0),
+                    'description': entry.get('description', signature.get('description', '')),
+                }
+
+                # Add InterPro entry if available
+                if entry:
+                    domain['interpro_id'] = entry.get('accession', '')
+                    domain['interpro_name'] = entry.get('name', '')
+
+                domains.append(domain)
+
+    return domains
+
+
+# TSV analysis names -> signature library names used in the JSON output
+TSV_LIBRARIES = {
+    'Pfam': 'PFAM',
+    'Gene3D': 'GENE3D',
+    'FunFam': 'FUNFAM',
+    'NCBIfam': 'NCBIFAM',
+    'Hamap': 'HAMAP',
+    'ProSiteProfiles': 'PROSITE_PROFILES',
+    'ProSitePatterns': 'PROSITE_PATTERNS',
+    'MobiDBLite': 'MOBIDB_LITE',
+    'Coils': 'COILS',
+    'AntiFam': 'ANTIFAM',
+}
+
+_JSON_CHUNK = 1 << 16
+_RESULTS_KEY = re.compile(r'"results"\s*:\s*\[')
+_VERSION_KEY = re.compile(r'"interproscan-version"\s*:\s*"([^"]*)"')
+
+
+def iter_json_results(f: IO[str], header: dict | None = None) -> Iterator[dict]:
+    """Stream the per-protein objects of an InterProScan JSON file.
+
+    Objects of the top-level "results" array are decoded one at a time, so
+    memory is bounded by the largest single result rather than the file.
+    If header is given, header['interproscan-version'] is filled in.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    eof = False
+
+    def fill():
+        nonlocal buf, eof
+        chunk = f.read(_JSON_CHUNK)
+        if chunk:
+            buf += chunk
+        else:
+            eof = True
+
+    def note_version(text: str):
+        match = _VERSION_KEY.search(text)
+        if header is not None and match:
+            header['interproscan-version'] = match.group(1)
+
+    while not (match := _RESULTS_KEY.search(buf)):
+        if eof:
+            note_version(buf)
+            return
+        fill()
+    note_version(buf[:match.start()])
+    buf = buf[match.end():]
+
+    while True:
+        buf = buf.lstrip(' \t\r\n,')
+        if not buf:
+            if eof:
+                raise ValueError("Truncated InterProScan JSON: results array not closed")
+            fill()
+            continue
+        if buf[0] == ']':
+            buf = buf[1:]
+            break
+        try:
+            result, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Partial object; read more and retry
+            fill()
+            continue
+        buf = buf[end:]
+        yield result
+
+    # Some releases write the version after the results
+    if header is not None and 'interproscan-version' not in header:
+        note_version(buf + f.read())
+
+
+def _tsv_match(fields: list[str]) -> dict:
+    """One TSV row as a JSON-style match with a single location."""
+    def column(i: int) -> str:
+        value = fields[i] if len(fields) > i else ''
+        return '' if value == '-' else value
+
+    library = TSV_LIBRARIES.get(fields[3], fields[3].upper())
+    entry = None
+    if column(11):
+        entry = {'accession': column(11), 'name': column(12), 'description': column(12)}
+
+    location = {'start': int(fields[6]), 'end': int(fields[7])}
+    if column(8):
+        # The score column holds the e-value for most member databases
+        location['evalue'] = float(column(8))
+
+    return {
+        'signature': {
+            'accession': fields[4],
+            'name': column(5),
+            'description': column(5),
+            'signatureLibraryRelease': {'library': library},
+            'entry': entry,
+        },
+        'locations': [location],
+    }
+
+
+def iter_tsv_results(f: IO[str]) -> Iterator[dict]:
+    """Stream InterProScan TSV output as JSON-style per-protein results.
+
+    Consecutive rows for the same protein accession are grouped into one
+    result, shaped like an entry of the JSON "results" array (xref, md5,
+    matches), so both formats go through parse_interpro_result().
+    """
+    current = None
+    for line in f:
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 8:
+            continue
+
+        if current is None or current['xref'][0]['id'] != fields[0]:
+            if current is not None:
+                yield current
+            current = {'xref': [{'id': fields[0]}], 'md5': fields[1], 'matches': []}
+        current['matches'].append(_tsv_match(fields))
+
+    if current is not None:
+        yield current
+
+
+def result_query_id(result: dict) -> str | None:
+    """The sequence identifier a per-protein result was submitted under."""
+    xrefs = result.get('xref') or []
+    return xrefs[0].get('id') if xrefs else None
+
+
+def iter_result_file(path: Path, header: dict | None = None) -> Iterator[dict]:
+    """Stream per-protein results from an InterProScan JSON or TSV file.
+
+    The format is taken from the extension (.json/.tsv, optionally .gz)
+    and otherwise sniffed from the first character.
+    """
+    path = Path(path)
+    opener = gzip.open if path.suffix == '.gz' else open
+    suffix = Path(path.stem).suffix if path.suffix == '.gz' else path.suffix
+
+    with opener(path, 'rt') as f:
+        if suffix.lower() == '.json':
+            is_json = True
+        elif suffix.lower() == '.tsv':
+            is_json = False
+        else:
+            char = f.read(1)
+            while char.isspace():
+                char = f.read(1)
+            is_json = char == '{'
+            f.seek(0)
+
+        if is_json:
+            yield from iter_json_results(f, header)
+        else:
+            yield from iter_tsv_results(f)
+
+
+class JobJournal:
+    """Crash-safe ledger of submitted InterProScan jobs (interpro_jobs table).
+
+    A job is recorded as RUNNING and flushed to disk as soon as EBI accepts
+    it. Its terminal status is queued by the caller after the genes' domain
+    rows, under BatchWriter.hold(), so both land in the same transaction. On
+    startup, RUNNING jobs younger than EBI's result retention are offered
+    back to the run by protein hash.
+    """
+
+    def __init__(self, writer: BatchWriter):
+        self.writer = writer
+        now = int(time.time())
+        cutoff = now - JOB_RETENTION_DAYS * 86400
+
+        with writer.conn:
+            # EBI drops results after its retention period; those jobs cannot be resumed
+            writer.conn.execute("""
+                UPDATE interpro_jobs SET status = 'EXPIRED', updated_at = ?
+                WHERE status = 'RUNNING' AND submitted_at < ?
+            """, (now, cutoff))
+            writer.conn.execute("""
+                DELETE FROM interpro_jobs WHERE status != 'RUNNING' AND updated_at < ?
+            """, (cutoff,))
+
+        self.outstanding: dict[str, tuple[str, int]] = {
+            protein_hash: (job_id, submitted_at)
+            for job_id, protein_hash, submitted_at in writer.conn.execute("""
+                SELECT job_id, protein_hash, submitted_at FROM interpro_jobs
+                WHERE status = 'RUNNING' ORDER BY submitted_at
+            """)
+        }
+        self.resumed = 0
+
+    def seed(self, model: CompletionModel) -> int:
+        """Feed run times of recently finished jobs into a completion model."""
+        rows = self.writer.conn.execute("""
+            SELECT protein_length, updated_at - submitted_at FROM interpro_jobs
+            WHERE status = 'FINISHED' AND protein_length IS NOT NULL
+        """).fetchall()
+        for length, seconds in rows:
+            model.observe(length, seconds)
+        return len(rows)
+
+    def claim(self, sequence: str) -> tuple[str, int] | None:
+        """Return (job_id, submitted_at) of an outstanding job for this protein, if any."""
+        job = self.outstanding.pop(protein_hash(sequence), None)
+        if job:
+            self.resumed += 1
+        return job
+
+    def submitted(self, job_id: str, sequence: str) -> int:
+        """Record a newly accepted job and return its submit time."""
+        now = int(time.time())
+        self.writer.add("""
+            INSERT OR REPLACE INTO interpro_jobs
+            (job_id, protein_hash, submitted_at, status, updated_at, protein_length)
+            VALUES (?, ?, ?, 'RUNNING', ?, ?)
+        """, (job_id, protein_hash(sequence), now, now, len(sequence)))
+        # Persist immediately; losing this row would orphan the remote job
+        self.writer.flush()
+        return now
+
+    def finished(self, job_id: str, status: str):
+        self.writer.add(
+            "UPDATE interpro_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+            (status, int(time.time()), job_id),
+        )
+
+
+class InterProBackend:
+    """Where InterProScan jobs run.
+
+    annotate() takes a protein group ({'protein_seq': ..., 'genes': [...]})
+    and returns (status, domains, interproscan_version, job_id); domains is
+    None when the job failed, and job_id is None unless the backend
+    journals its jobs. Once the group's rows are queued, the caller passes
+    job_id and status to finished(). Use as an async context manager
+    around the run.
+    """
+
+    name = "interproscan"
+    max_in_flight = 1
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def annotate(self, group: dict) -> tuple[str, list[dict] | None, str | None, str | None]:
+        raise NotImplementedError
+
+    def finished(self, job_id: str | None, status: str):
+        """Record a job's terminal status, after the caller queued its results."""
+
+    async def drain(self):
+        """Called once no more groups will be submitted."""
+
+    def remaining_seconds(self) -> float:
+        """Expected time until the work already started has finished."""
+        return 0.0
+
+    def expected_seconds(self) -> float:
+        """Expected time to finish max_in_flight more proteins."""
+        return 0.0
+
+    def report(self, job_count: int):
+        """Print backend statistics at the end of a run."""
+
+
+class RemoteBackend(InterProBackend):
+    """EBI's InterProScan REST service.
+
+    Each protein is its own job. Jobs are journaled in interpro_jobs, so a
+    job left running by an interrupted run is resumed rather than
+    resubmitted, and polled by a PollScheduler. With a pipeline context,
+    the HTTP session is the context's shared one and is left open.
+    """
+
+    name = "remote"
+
+    def __init__(self, writer: BatchWriter, email: str,
+                 max_in_flight: int = MAX_JOBS_IN_FLIGHT,
+                 max_requests: int = MAX_CONCURRENT_REQUESTS,
+                 ctx: PipelineContext | None = None):
+        self.email = email
+        self.max_in_flight = max_in_flight
+        self.max_requests = max_requests
+        self.ctx = ctx
+        self.journal = JobJournal(writer)
+        self.model = CompletionModel()
+        self.session = None
+        self.scheduler = None
+        self._poller = None
+
+    async def start(self):
+        if self.journal.outstanding:
+            print(f"Journal has {len(self.journal.outstanding)} outstanding jobs from a previous run")
+        seeded = self.journal.seed(self.model)
+        if seeded:
+            print(f"Expecting ~{self.model.expected():.0f}s per job from {seeded} recent jobs")
+
+        limiter = RequestLimiter(self.max_requests, REQUEST_DELAY)
+        def new_session():
+            return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_requests))
+
+        self.session = self.ctx.http_session('interpro', new_session) if self.ctx else new_session()
+        self.scheduler = PollScheduler(self.session, limiter, self.model)
+        self._poller = asyncio.create_task(self.scheduler.run())
+
+    async def close(self):
+        if self._poller:
+            self._poller.cancel()
+        if self.session and not self.ctx:
+            await self.session.close()
+
+    async def annotate(self, group: dict) -> tuple[str, list[dict] | None, str | None, str | None]:
+        """Run one protein through submit, poll and fetch.
+
+        A protein with a job in the journal skips submission. The job's
+        terminal status is left to finished(), so the caller can queue it
+        after the genes' domain rows.
+        """
+        sequence = group['protein_seq']
+        resumed = self.journal.claim(sequence)
+        if resumed:
+            job_id, submitted_at = resumed
+        else:
+            job_id = await submit_interpro_job(self.session, self.scheduler.limiter, sequence, self.email)
+            submitted_at = self.journal.submitted(job_id, sequence)
+
+        status = await self.scheduler.watch(job_id, len(sequence), submitted_at)
+        if status != 'FINISHED':
+            return status, None, None, job_id
+
+        result = await get_job_result(self.session, self.scheduler.limiter, job_id)
+        return status, parse_interpro_result(result), result.get('interproscan-version'), job_id
+
+    def finished(self, job_id: str | None, status: str):
+        self.journal.finished(job_id, status)
+
+    def remaining_seconds(self) -> float:
+        return self.scheduler.remaining_seconds()
+
+    def expected_seconds(self) -> float:
+        return self.model.expected()
+
+    def report(self, job_count: int):
+        if job_count:
+            checks = self.scheduler.status_checks
+            print(f"{checks} status checks for {job_count} jobs ({checks / job_count:.1f} per job)")
+        if self.journal.resumed:
+            print(f"Resumed {self.journal.resumed} jobs from the journal instead of resubmitting")
+
+
+class LocalBackend(InterProBackend):
+    """A locally installed interproscan.sh.
+
+    Proteins are collected into shards of shard_size and each full shard is
+    written as one multi-FASTA file and run by a separate interproscan.sh
+    process, at most `workers` at a time. The output (JSON or TSV) is
+    stream-parsed back into per-protein domains. The executable is
+    configurable, so any script that accepts interproscan.sh's -i/-f/-o
+    arguments can stand in for it.
+    """
+
+    name = "local"
+
+    def __init__(self, executable: str = DEFAULT_INTERPROSCAN,
+                 shard_size: int = DEFAULT_SHARD_SIZE,
+                 workers: int = DEFAULT_LOCAL_WORKERS,
+                 cpu: int = DEFAULT_LOCAL_CPU,
+                 output_format: str = 'json',
+                 work_dir: str | None = None):
+        resolved = shutil.which(executable)
+        if not resolved:
+            raise FileNotFoundError(f"InterProScan executable not found: {executable}")
+        self.executable = resolved
+        self.shard_size = shard_size
+        self.workers = workers
+        self.cpu = cpu
+        self.output_format = output_format
+        self.work_dir = work_dir
+        self.max_in_flight = shard_size * workers
+        self.version = None
+        self.shards_run = 0
+        self._shard: list[tuple[dict, asyncio.Future]] = []
+        self._slots = None
+        self._running: dict[int, float] = {}  # shard id -> start time
+        self._shard_ids = count()
+        self._tasks = set()
+        self._draining = False
+        self._shard_seconds = 0.0
+
+    async def start(self):
+        self._slots = asyncio.Semaphore(self.workers)
+        if self.output_format == 'tsv':
+            # TSV output does not name the InterProScan release; ask the executable
+            self.version = await self._probe_version()
+        print(f"Running {self.executable} on shards of {self.shard_size} proteins, "
+              f"{self.workers} at a time")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+    async def _probe_version(self) -> str | None:
+        proc = await asyncio.create_subprocess_exec(
+            self.executable, '--version',
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        )
+        output, _ = await proc.communicate()
+        match = re.search(r'version\s+(\S+)', output.decode(errors='replace'), re.IGNORECASE)
+        return match.group(1) if match else None
+
+    async def annotate(self, group: dict) -> tuple[str, list[dict] | None, str | None, str | None]:
+        future = asyncio.get_running_loop().create_future()
+        self._shard.append((group, future))
+        if len(self._shard) >= self.shard_size or self._draining:
+            self._launch()
+        return await future
+
+    async def drain(self):
+        # Let groups created just before the stream ended join the last shard
+        await asyncio.sleep(0)
+        self._draining = True
+        if self._shard:
+            self._launch()
+
+    def _launch(self):
+        shard, self._shard = self._shard, []
+        task = asyncio.create_task(self._run_shard(shard))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_shard(self, shard: list[tuple[dict, asyncio.Future]]):
+        async with self._slots:
+            shard_id = next(self._shard_ids)
+            started = time.time()
+            self._running[shard_id] = started
+            try:
+                results = await self._interproscan(shard)
+            except Exception as e:
+                print(f"interproscan.sh failed on a shard of {len(shard)} proteins: {e}")
+                results = [('FAILURE', None, None, None)] * len(shard)
+            else:
+                self.shards_run += 1
+                self._shard_seconds += time.time() - started
+            finally:
+                del self._running[shard_id]
+
+        for (_, future), result in zip(shard, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _interproscan(self, shard: list[tuple[dict, asyncio.Future]]) -> list[tuple]:
+        with tempfile.TemporaryDirectory(prefix="iprscan_", dir=self.work_dir) as tmp:
+            fasta = Path(tmp) / "shard.fasta"
+            output = Path(tmp) / f"shard.{self.output_format}"
+            # Positional ids; InterProScan rewrites or truncates long FASTA headers
+            with open(fasta, 'w') as f:
+                for i, (group, _) in enumerate(shard):
+                    f.write(f">p{i}\n{group['protein_seq']}\n")
+
+            proc = await asyncio.create_subprocess_exec(
+                self.executable,
+                '-i', str(fasta),
+                '-f', self.output_format.upper(),
+                '-o', str(output),
+                '-cpu', str(self.cpu),
+                '-T', str(Path(tmp) / "temp"),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await proc.communicate()
+            if proc.returncode != 0:
+                tail = stderr.decode(errors='replace').strip().splitlines()[-1:]
+                raise RuntimeError(f"exit code {proc.returncode}: {' '.join(tail)}")
+
+            domains: dict[str, list[dict]] = defaultdict(list)
+            header = {}
+            with open(output) as f:
+                if self.output_format == 'json':
+                    results = iter_json_results(f, header)
+                else:
+                    results = iter_tsv_results(f)
+                for result in results:
+                    domains[result_query_id(result)].extend(parse_interpro_result({'results': [result]}))
+
+        version = header.get('interproscan-version') or self.version
+        # Proteins absent from the output (TSV lists only matches) had no hits
+        return [('FINISHED', domains.get(f"p{i}", []), version, None) for i in range(len(shard))]
+
+    def remaining_seconds(self) -> float:
+        now = time.time()
+        expected = self.expected_seconds()
+        return max((max(started + expected - now, 0.0) for started in self._running.values()), default=0.0)
+
+    def expected_seconds(self) -> float:
+        if self.shards_run:
+            return self._shard_seconds / self.shards_run
+        return DEFAULT_SHARD_SECONDS
+
+    def report(self, job_count: int):
+        if self.shards_run:
+            print(f"{self.shards_run} interproscan.sh shards, "
+                  f"{self.expected_seconds():.0f}s per shard on average")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+On-disk InterProScan Result Cache
+
+Content-addressed store of parsed InterProScan domains, keyed by a hash of
+the protein sequence and the InterProScan version that produced them. The
+annotation workflow persists ~/.interpro_cache between runs, so a protein
+seen in an earlier run is resolved locally instead of by a new remote job.
+
+Layout:
+    ~/.interpro_cache/VERSION                      last InterProScan version seen
+    ~/.interpro_cache/<version>/<aa>/<sha256>.json.gz
+
+The cache is size-bounded: prune() evicts entries from stale versions first,
+then least recently used entries, until the total size fits the budget.
+
+Usage:
+    python interpro_cache.py [--cache-dir DIR] [--max-mb N]   # prune and report
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+DEFAULT_CACHE_DIR = Path.home() / ".interpro_cache"
+DEFAULT_MAX_MB = 256
+
+
+def protein_hash(sequence: str) -> str:
+    """Content hash of a translated protein sequence."""
+    return hashlib.sha256(sequence.encode('ascii')).hexdigest()
+
+
+def version_key(version: str) -> tuple[int, ...]:
+    """Sortable form of an InterProScan version ("5.66-98.0" -> (5, 66, 98, 0))."""
+    return tuple(int(part) for part in re.findall(r'\d+', version))
+
+
+class InterProCache:
+    """Persistent protein sequence -> domain list cache."""
+
+    def __init__(self, root: Path = DEFAULT_CACHE_DIR, max_mb: int = DEFAULT_MAX_MB,
+                 version: str | None = None):
+        self.root = Path(root).expanduser()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.version = version or self._read_version()
+        self.hits = 0
+        self.misses = 0
+
+    def _read_version(self) -> str | None:
+        path = self.root / "VERSION"
+        if path.exists():
+            return path.read_text().strip() or None
+        return None
+
+    def _set_version(self, version: str):
+        self.version = version
+        tmp = self.root / "VERSION.tmp"
+        tmp.write_text(version)
+        os.replace(tmp, self.root / "VERSION")
+
+    def _path(self, sequence: str, version: str) -> Path:
+        digest = protein_hash(sequence)
+        safe_version = re.sub(r'[^A-Za-z0-9._-]', '_', version)
+        return self.root / safe_version / digest[:2] / f"{digest}.json.gz"
+
+    def get(self, sequence: str) -> list[dict] | None:
+        """Return cached domains for a protein, or None on a miss.
+
+        An empty list is a cached "no hits" result, not a miss.
+        """
+        if not self.version:
+            self.misses += 1
+            return None
+
+        path = self._path(sequence, self.version)
+        try:
+            with gzip.open(path, 'rt') as f:
+                domains = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # Refresh mtime so eviction is least-recently-used
+        os.utime(path)
+        self.hits += 1
+        return domains
+
+    def put(self, sequence: str, domains: list[dict], version: str | None):
+        """Store domains for a protein under the InterProScan version that produced them.
+
+        Results from an older version than the cache's (e.g. a local
+        InterProScan behind the remote service) are not stored, so mixed
+        versions cannot flip the cache back and forth.
+        """
+        version = version or self.version
+        if not version:
+            return
+        if version != self.version:
+            if self.version and version_key(version) <= version_key(self.version):
+                return
+            # A newer InterProScan release invalidates every older entry
+            self._set_version(version)
+
+        path = self._path(sequence, version)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with gzip.open(tmp, 'wt') as f:
+            json.dump(domains, f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    def prune(self) -> int:
+        """Evict entries until the cache fits max_bytes. Returns bytes removed."""
+        entries = []
+        total = 0
+        for path in self.root.glob("*/*/*.json.gz"):
+            stat = path.stat()
+            current = path.parent.parent.name == self.version
+            entries.append((current, stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        removed = 0
+        # Stale versions first, then oldest access time
+        for current, _, size, path in sorted(entries):
+            if total - removed <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            removed += size
+
+        return removed
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        rate = 100 * self.hits / lookups if lookups else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune the InterProScan result cache")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR), help="Cache directory")
+    parser.add_argument("--max-mb", type=int, default=DEFAULT_MAX_MB, help="Cache size budget in MB")
+    args = parser.parse_args()
+
+    cache = InterProCache(Path(args.cache_dir), args.max_mb)
+    removed = cache.prune()
+    print(f"InterProScan version: {cache.version or 'unknown'}")
+    print(f"Evicted {removed / (1024 * 1024):.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Persistent KEGG Lookup Cache
+
+Memoizes KEGG link lookups (Pfam -> KO, KO -> pathway), and the InterPro
+entry -> Pfam member lookups used to route domains to them, in the
+kegg_cache table of phage.db. Lookups are deduplicated in memory for the
+current run and persisted for later runs; entries older than the TTL are
+refetched.
+
+Usage:
+    cache = KeggCache(writer, ttl_days=30)
+    kos = cache.get('pfam_ko', 'PF00001')
+    if kos is None:
+        kos = fetch(...)
+        cache.put('pfam_ko', 'PF00001', kos)
+"""
+
+import json
+import time
+
+from db_writer import BatchWriter
+
+DEFAULT_TTL_DAYS = 30
+
+
+def ensure_cache_table(conn):
+    """Create the kegg_cache table if it does not exist."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS kegg_cache (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            fetched_at INTEGER NOT NULL,
+            PRIMARY KEY (kind, key)
+        )
+    """)
+
+
+class KeggCache:
+    """Two-level (in-run memo, SQLite table) cache of KEGG lookups."""
+
+    def __init__(self, writer: BatchWriter, ttl_days: float = DEFAULT_TTL_DAYS):
+        self.writer = writer
+        self.ttl = ttl_days * 86400
+        self._memo: dict[tuple[str, str], list] = {}
+        self.memo_hits = 0
+        self.hits = 0
+        self.misses = 0
+
+        with writer.conn:
+            ensure_cache_table(writer.conn)
+            writer.conn.execute(
+                "DELETE FROM kegg_cache WHERE fetched_at < ?", (int(time.time() - self.ttl),)
+            )
+
+    def get(self, kind: str, key: str) -> list | None:
+        """Return a cached lookup result, or None on a miss.
+
+        An empty list is a cached "no links" result, not a miss.
+        """
+        memo_key = (kind, key)
+        if memo_key in self._memo:
+            self.memo_hits += 1
+            return self._memo[memo_key]
+
+        row = self.writer.conn.execute(
+            "SELECT value FROM kegg_cache WHERE kind = ? AND key = ? AND fetched_at >= ?",
+            (kind, key, int(time.time() - self.ttl)),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        value = json.loads(row[0])
+        self._memo[memo_key] = value
+        self.hits += 1
+        return value
+
+    def put(self, kind: str, key: str, value: list):
+        """Store a lookup result for this run and later ones."""
+        self._memo[(kind, key)] = value
+        self.writer.add(
+            "INSERT OR REPLACE INTO kegg_cache (kind, key, value, fetched_at) VALUES (?, ?, ?, ?)",
+            (kind, key, json.dumps(value), int(time.time())),
+        )
+
+    def stats(self) -> str:
+        lookups = self.memo_hits + self.hits + self.misses
+        rate = 100 * (self.memo_hits + self.hits) / lookups if lookups else 0.0
+        return (f"{self.memo_hits} in-run hits, {self.hits} persistent hits, "
+                f"{self.misses} misses ({rate:.0f}% hit rate)")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Async KEGG REST Client
+
+One keep-alive aiohttp session shared by every KEGG request, paced by a
+token bucket held at KEGG's allowed request rate. Requests refused with
+403 (KEGG's throttling response), 429 or a 5xx status are retried with
+exponential backoff and full jitter.
+
+Usage:
+    async with KeggClient() as client:
+        pairs = await client.link_table('ko', 'pfam:PF00001')
+"""
+
+import asyncio
+import random
+import re
+import time
+
+import aiohttp
+
+# KEGG REST API base URL
+KEGG_API = "https://rest.kegg.jp"
+
+# KEGG allows at most 10 requests per second per client
+KEGG_RATE = 10.0  # requests per second
+MAX_CONNECTIONS = 4
+
+MAX_RETRIES = 4
+RETRY_BASE_DELAY = 1.0  # seconds; doubled on every retry
+RETRY_STATUSES = {403, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second, with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def new_session(max_connections: int = MAX_CONNECTIONS) -> aiohttp.ClientSession:
+    """Keep-alive session sized for KEGG; create it inside a running event loop."""
+    connector = aiohttp.TCPConnector(limit=max_connections, keepalive_timeout=60)
+    return aiohttp.ClientSession(connector=connector)
+
+
+class KeggClient:
+    """Rate-limited, retrying KEGG REST client over a pooled session.
+
+    Pass `session` to reuse a session owned by the caller (it is left open);
+    otherwise the client opens and closes its own.
+    """
+
+    def __init__(self, rate: float = KEGG_RATE, max_connections: int = MAX_CONNECTIONS,
+                 session: aiohttp.ClientSession | None = None):
+        self.bucket = TokenBucket(rate)
+        self.max_connections = max_connections
+        self.session = session
+        self._owns_session = session is None
+        self.requests = 0
+        self.retries = 0
+        self._started = None
+
+    async def __aenter__(self):
+        if self._owns_session:
+            self.session = new_session(self.max_connections)
+        self._started = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._owns_session:
+            await self.session.close()
+
+    async def get_text(self, path: str, timeout: float = 30) -> str | None:
+        """GET a KEGG REST path. Returns '' for 404 and None if KEGG could not be reached."""
+        url = f"{KEGG_API}/{path}"
+        for attempt in range(MAX_RETRIES + 1):
+            await self.bucket.acquire()
+            self.requests += 1
+            try:
+                async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                    if resp.status == 200:
+                        return await resp.text()
+                    if resp.status == 404:
+                        return ''
+                    if resp.status not in RETRY_STATUSES:
+                        return None
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+
+            if attempt < MAX_RETRIES:
+                self.retries += 1
+                await asyncio.sleep(random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt))
+
+        return None
+
+    async def link_table(self, target: str, source: str, timeout: float = 30) -> list[tuple[str, str]] | None:
+        """Fetch a KEGG link table as (source entry, target entry) pairs.
+
+        source is a database name ("pfam") for the whole table or a single
+        entry ("pfam:PF00001"). Returns None if KEGG could not be reached.
+        """
+        text = await self.get_text(f"link/{target}/{source}", timeout)
+        if text is None:
+            return None
+
+        pairs = []
+        for line in text.strip().split('\n'):
+            if '\t' in line:
+                entry, other = line.split('\t')
+                pairs.append((entry, other))
+        return pairs
+
+    async def link(self, target: str, entry: str) -> list[str] | None:
+        """Return the `target` entries KEGG links to `entry`, or None if KEGG could not be reached."""
+        pairs = await self.link_table(target, entry)
+        return None if pairs is None else [other for _, other in pairs]
+
+    async def release(self) -> str | None:
+        """Current KEGG release string, e.g. "110.0+/05-01", or None if unavailable."""
+        text = await self.get_text("info/kegg")
+        match = re.search(r'Release\s+(\S+?),?\s', text or '')
+        return match.group(1) if match else None
+
+    def stats(self) -> str:
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        rate = self.requests / elapsed if elapsed else 0.0
+        return f"{self.requests} KEGG requests ({self.retries} retries, {rate:.1f}/s)"
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Offline KEGG Link Snapshot
+
+A versioned SQLite file holding the KEGG link tables AMG detection needs
+(pfam -> ko, ko -> pathway, ko -> reaction), so detect_amgs_from_domains
+can run without network access and give the same result every time.
+
+Format (SNAPSHOT_FORMAT = 1):
+    meta(key, value)          format, kegg_release, created_at, digest
+    links(kind, key, value)   one row per source entry; value holds the
+                              linked entries, comma-separated
+
+The file is opened read-only and memory-mapped; each lookup is a primary
+key probe, memoized for the run. Snapshots are written by
+`fetch_kegg.py --refresh-snapshot PATH`.
+
+Usage:
+    python kegg_snapshot.py kegg_snapshot.db    # show version and contents
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+SNAPSHOT_FORMAT = 1
+MMAP_BYTES = 256 * 1024 * 1024
+
+
+def snapshot_digest(links: dict[str, dict[str, list[str]]]) -> str:
+    """Content hash of a set of link tables, independent of insertion order."""
+    digest = hashlib.sha256()
+    for kind in sorted(links):
+        for key in sorted(links[kind]):
+            digest.update(f"{kind}\t{key}\t{','.join(sorted(links[kind][key]))}\n".encode())
+    return digest.hexdigest()
+
+
+def write_snapshot(path: Path, links: dict[str, dict[str, list[str]]], kegg_release: str | None = None) -> str:
+    """Write link tables to a snapshot file, replacing it atomically. Returns its digest."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    digest = snapshot_digest(links)
+
+    conn = sqlite3.connect(tmp)
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    conn.execute("""
+        CREATE TABLE links (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+    """)
+    with conn:
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+            ('format', str(SNAPSHOT_FORMAT)),
+            ('kegg_release', kegg_release or 'unknown'),
+            ('created_at', str(int(time.time()))),
+            ('digest', digest),
+        ])
+        for kind, index in links.items():
+            conn.executemany(
+                "INSERT INTO links (kind, key, value) VALUES (?, ?, ?)",
+                ((kind, key, ','.join(values)) for key, values in index.items()),
+            )
+    conn.execute("VACUUM")
+    conn.close()
+
+    os.replace(tmp, path)
+    return digest
+
+
+class SnapshotTable:
+    """Read-only mapping of one link kind, backed by the snapshot file."""
+
+    def __init__(self, conn: sqlite3.Connection, kind: str):
+        self.conn = conn
+        self.kind = kind
+        self._memo: dict[str, list[str] | None] = {}
+
+    def get(self, key: str, default=None) -> list[str] | None:
+        if key not in self._memo:
+            row = self.conn.execute(
+                "SELECT value FROM links WHERE kind = ? AND key = ?", (self.kind, key)
+            ).fetchone()
+            self._memo[key] = row[0].split(',') if row and row[0] else None
+        value = self._memo[key]
+        return default if value is None else value
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM links WHERE kind = ?", (self.kind,)).fetchone()[0]
+
+
+class KeggSnapshot:
+    """An opened snapshot file."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"KEGG snapshot not found: {self.path}")
+
+        self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        self.conn.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+        self.meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        if self.meta.get('format') != str(SNAPSHOT_FORMAT):
+            raise ValueError(f"Unsupported KEGG snapshot format {self.meta.get('format')} in {self.path}")
+
+    @property
+    def version(self) -> str:
+        """Release and content digest, e.g. "110.0+/05-01@3f2a9c1e0b7d"."""
+        return f"{self.meta['kegg_release']}@{self.meta['digest'][:12]}"
+
+    def kinds(self) -> list[str]:
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT kind FROM links ORDER BY kind")]
+
+    def tables(self) -> dict[str, SnapshotTable]:
+        return {kind: SnapshotTable(self.conn, kind) for kind in self.kinds()}
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Describe a KEGG link snapshot")
+    parser.add_argument("snapshot", help="Path to the snapshot file")
+    args = parser.parse_args()
+
+    try:
+        snapshot = KeggSnapshot(Path(args.snapshot))
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+
+    created = time.strftime('%Y-%m-%d %H:%M', time.localtime(int(snapshot.meta['created_at'])))
+    print(f"KEGG release: {snapshot.meta['kegg_release']}")
+    print(f"Created: {created}")
+    print(f"Digest: {snapshot.meta['digest']}")
+    for kind, table in snapshot.tables().items():
+        print(f"  {kind}: {len(table)} entries")
+    snapshot.close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
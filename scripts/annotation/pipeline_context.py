@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Shared Pipeline Context
+
+State shared by annotation steps run in one process (run_pipeline.py
+--in-process), so expensive setup happens once per pipeline run instead
+of once per step:
+
+    connection()     pooled read connection to phage.db (one per thread)
+    genome()         decoded genomes, LRU-cached within a size budget
+    run_async()      one event loop for every step's async work, so HTTP
+    http_session()   sessions and their keep-alive connections are reused
+
+Steps take `ctx=None`; without a context they open their own connections
+and event loop, exactly as when run as standalone scripts. Writes still
+go through each step's own BatchWriter. Closing the context switches
+phage.db back out of WAL mode, which the steps' writers cannot do while
+pooled connections are open.
+
+Usage:
+    with PipelineContext("phage.db") as ctx:
+        annotate_domains.main(["--db", "phage.db"], ctx)
+        fetch_kegg.main(["--db", "phage.db"], ctx)
+"""
+
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable
+
+from db_writer import KEEP_WAL_ENV, leave_wal
+
+if TYPE_CHECKING:
+    # Annotations only, so standalone codon steps do not load aiohttp;
+    # run_pipeline always imports it via annotate_domains and fetch_kegg
+    import aiohttp
+
+DEFAULT_GENOME_CACHE_MB = 256
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connection owned by a PipelineContext; close() from a step leaves it open."""
+
+    def close(self):
+        pass
+
+    def release(self):
+        super().close()
+
+
+def read_genome(conn: sqlite3.Connection, phage_id: int) -> str:
+    """Reassemble a phage genome from its sequence chunks."""
+    chunks = conn.execute(
+        "SELECT sequence FROM sequences WHERE phage_id = ? ORDER BY chunk_index", (phage_id,)
+    ).fetchall()
+    return ''.join(c[0] for c in chunks)
+
+
+def connect(db_path: str, ctx: 'PipelineContext | None' = None) -> sqlite3.Connection:
+    """Read connection: the context's pooled one, or a new one the caller closes."""
+    return ctx.connection() if ctx else sqlite3.connect(db_path)
+
+
+async def _in_context(context: contextvars.Context, coro):
+    """Await coro with the context variables of `context` set in this task."""
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def run_coroutine(coro, ctx: 'PipelineContext | None' = None):
+    """Run a coroutine to completion on the context's loop, or a fresh one."""
+    return ctx.run_async(coro) if ctx else asyncio.run(coro)
+
+
+class PipelineContext:
+    """Connections, genomes and HTTP sessions shared by in-process steps."""
+
+    def __init__(self, db_path: str, genome_cache_mb: float = DEFAULT_GENOME_CACHE_MB):
+        self.db_path = str(db_path)
+        self.genome_cache_bytes = int(genome_cache_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: list[PooledConnection] = []
+        self._genomes: OrderedDict[int, str] = OrderedDict()
+        self._genome_bytes = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: threading.Thread | None = None
+        self._sessions: dict[str, 'aiohttp.ClientSession'] = {}
+        self.genome_hits = 0
+        self.genome_misses = 0
+        self.connections_opened = 0
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's pooled read connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, factory=PooledConnection, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+                self.connections_opened += 1
+        return conn
+
+    def genome(self, phage_id: int) -> str:
+        """A phage's genome, decoded once per run while it fits in the cache."""
+        with self._lock:
+            genome = self._genomes.get(phage_id)
+            if genome is not None:
+                self._genomes.move_to_end(phage_id)
+                self.genome_hits += 1
+                return genome
+            self.genome_misses += 1
+
+        genome = read_genome(self.connection(), phage_id)
+        with self._lock:
+            if phage_id not in self._genomes and len(genome) <= self.genome_cache_bytes:
+                self._genomes[phage_id] = genome
+                self._genome_bytes += len(genome)
+                while self._genome_bytes > self.genome_cache_bytes:
+                    _, evicted = self._genomes.popitem(last=False)
+                    self._genome_bytes -= len(evicted)
+        return genome
+
+    def run_async(self, coro):
+        """Run a coroutine on the shared event loop and wait for its result.
+
+        The coroutine sees the calling thread's context variables.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+                self._loop_thread.start()
+        coro = _in_context(contextvars.copy_context(), coro)
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def http_session(self, name: str, factory: Callable[[], 'aiohttp.ClientSession']) -> 'aiohttp.ClientSession':
+        """The shared session called `name`, created by factory on first use.
+
+        Must be called from a coroutine running under run_async().
+        """
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            session = factory()
+            self._sessions[name] = session
+        return session
+
+    def stats(self) -> str:
+        lookups = self.genome_hits + self.genome_misses
+        return (f"{self.genome_hits}/{lookups} genome loads from cache, "
+                f"{len(self._sessions)} shared HTTP sessions, {self.connections_opened} DB connections")
+
+    def release_connections(self):
+        """Close every pooled connection; threads open new ones on next use."""
+        with self._lock:
+            for conn in self._connections:
+                conn.release()
+            self._connections.clear()
+            self._local = threading.local()
+
+    def close(self):
+        if self._loop is not None:
+            async def close_sessions():
+                for session in self._sessions.values():
+                    await session.close()
+
+            asyncio.run_coroutine_threadsafe(close_sessions(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop.close()
+            self._loop = None
+        self._sessions.clear()
+
+        self.release_connections()
+        self._genomes.clear()
+        self._genome_bytes = 0
+
+        # Steps' writers could not leave WAL mode while the pooled
+        # connections were open, so do it now that they are closed
+        if self.connections_opened and not os.environ.get(KEEP_WAL_ENV):
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            leave_wal(conn)
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
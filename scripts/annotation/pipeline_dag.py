@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Pipeline Step Scheduler
+
+Runs annotation steps as a DAG: each step declares the steps it depends
+on and starts as soon as they have finished, with up to `workers` steps
+running at once. A step whose dependency failed is not run.
+
+Before a step runs, its inputs are fingerprinted: the script and the local
+modules it imports, its command line, and cheap summaries of the tables it
+reads and writes. If the fingerprint matches the one stored in
+pipeline_steps after the step's last successful run, the step is skipped
+as unchanged. Steps that work incrementally can declare a `pending` query
+counting work they left for a later run (genes past --limit, failures to
+retry); while it is nonzero the step always runs.
+
+After the run, the critical path (the chain of dependent steps with the
+longest total run time, counting only steps that ran) is reported; it bounds the end-to-end time no
+matter how many workers are used.
+
+The database stays in WAL mode for the whole run so concurrent steps do
+not contend over the journal mode; it is switched back at the end.
+
+With a PipelineContext, steps run in-process instead of as subprocesses:
+the step's script is imported and its main(argv, ctx) called on a worker
+thread, so connections, cached genomes and HTTP sessions are shared
+between steps rather than rebuilt by each one. With more than one worker,
+output of either kind is prefixed with the name of the step printing it.
+
+Usage:
+    steps = [Step("a", cmd_a), Step("b", cmd_b, deps=["a"], inputs=["genes"])]
+    ok = run_dag(steps, db_path, workers=2)
+
+    with PipelineContext(db_path) as ctx:
+        ok = run_dag(steps, db_path, workers=2, ctx=ctx)
+"""
+
+import ast
+import contextvars
+import hashlib
+import importlib
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from db_writer import KEEP_WAL_ENV, leave_wal
+from pipeline_context import PipelineContext
+
+# Cheap per-table summaries that change whenever a step rewrites the table
+TABLE_FINGERPRINTS = {
+    'genes': "SELECT COUNT(*), MAX(id), SUM(start_pos + end_pos) FROM genes",
+    'sequences': "SELECT COUNT(*), MAX(rowid) FROM sequences",
+    'protein_domains': "SELECT COUNT(*), MAX(id) FROM protein_domains",
+    'amg_annotations': "SELECT COUNT(*), MAX(id) FROM amg_annotations",
+    'host_trna_pools': "SELECT COUNT(*), MAX(id) FROM host_trna_pools",
+    'host_trna_hosts': "SELECT COUNT(*), SUM(updated_at) FROM host_trna_hosts",
+    'host_codon_weights': "SELECT COUNT(*), SUM(compiled_at) FROM host_codon_weights",
+    'gene_codon_matrix': "SELECT COUNT(*), SUM(updated_at) FROM gene_codon_matrix",
+    'codon_adaptation': "SELECT COUNT(*), MAX(id) FROM codon_adaptation",
+    'adaptation_profiles': "SELECT COUNT(*), MAX(id) FROM adaptation_profiles",
+    'host_rankings': "SELECT COUNT(*), SUM(created_at) FROM host_rankings",
+}
+
+
+class Step:
+    """One pipeline step: a command, the steps it waits for, and what it reads and writes."""
+
+    def __init__(
+        self,
+        name: str,
+        cmd: list[str],
+        deps: list[str] | None = None,
+        inputs: list[str] | None = None,
+        outputs: list[str] | None = None,
+        files: list[Path] | None = None,
+        pending: str | None = None,
+        enabled: bool = True,
+    ):
+        self.name = name
+        self.cmd = cmd
+        self.deps = deps or []
+        self.inputs = inputs or []
+        self.outputs = outputs or []
+        self.files = files or []
+        self.pending = pending
+        self.enabled = enabled
+
+
+def ensure_state_table(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_steps (
+            name TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            seconds REAL,
+            finished_at INTEGER
+        )
+    """)
+    conn.commit()
+
+
+def _file_summary(path: Path) -> str:
+    """Name, size and mtime of a file, or of every file directly in a directory."""
+    paths = sorted(path.iterdir()) if path.is_dir() else [path]
+    parts = []
+    for p in paths:
+        try:
+            stat = p.stat()
+            parts.append(f"{p.name}:{stat.st_size}:{int(stat.st_mtime)}")
+        except OSError:
+            parts.append(f"{p.name}:missing")
+    return ','.join(parts)
+
+
+def local_sources(script: Path) -> list[Path]:
+    """A script and every module it imports, directly or not, from its own directory."""
+    seen: set[Path] = set()
+    todo = [script.resolve()]
+    while todo:
+        path = todo.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        try:
+            tree = ast.parse(path.read_bytes())
+        except SyntaxError:
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                candidate = path.parent / f"{module.split('.')[0]}.py"
+                if candidate.is_file():
+                    todo.append(candidate)
+    return sorted(seen)
+
+
+def step_fingerprint(conn: sqlite3.Connection, step: Step) -> str:
+    """Fingerprint of everything a step's result depends on."""
+    digest = hashlib.sha256()
+    digest.update('\0'.join(step.cmd).encode())
+
+    # The script and its local imports are inputs: editing any of them must rerun the step
+    for arg in step.cmd:
+        if arg.endswith('.py') and Path(arg).is_file():
+            for source in local_sources(Path(arg)):
+                digest.update(f"{source.name}=".encode())
+                digest.update(hashlib.sha256(source.read_bytes()).digest())
+
+    for table in sorted(set(step.inputs) | set(step.outputs)):
+        try:
+            row = conn.execute(TABLE_FINGERPRINTS[table]).fetchone()
+        except sqlite3.OperationalError:
+            row = 'missing'
+        digest.update(f"{table}={row}\n".encode())
+
+    for path in step.files:
+        digest.update(f"{path}={_file_summary(Path(path))}\n".encode())
+
+    return digest.hexdigest()
+
+
+def has_pending_work(conn: sqlite3.Connection, step: Step) -> bool:
+    """Whether a step's pending query reports work left over from earlier runs."""
+    if not step.pending:
+        return False
+    try:
+        return bool(conn.execute(step.pending).fetchone()[0])
+    except sqlite3.OperationalError:
+        # Its tables do not exist yet, so the step has never finished
+        return True
+
+
+def _execute(step: Step, prefix: bool) -> tuple[bool, float]:
+    """Run a step's command. Returns (succeeded, seconds).
+
+    With prefix, the step's output is streamed line by line as
+    "[step] line", so concurrent steps stay readable and a step killed
+    mid-run still leaves its log behind.
+    """
+    # Steps must not switch the journal mode while other steps have the database open
+    env = {**os.environ, KEEP_WAL_ENV: "1", "PYTHONUNBUFFERED": "1"}
+    started = time.monotonic()
+    try:
+        if not prefix:
+            result = subprocess.run(step.cmd, env=env)
+            return result.returncode == 0, time.monotonic() - started
+
+        with subprocess.Popen(step.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env) as proc:
+            for raw in proc.stdout:
+                # Progress bars redraw with \r; keep only the latest state of the line
+                line = raw.decode(errors='replace').rstrip('\r\n').split('\r')[-1]
+                if line.strip():
+                    print(f"[{step.name}] {line}", flush=True)
+        return proc.returncode == 0, time.monotonic() - started
+    except FileNotFoundError:
+        print(f"[{step.name}] Command not found: {step.cmd[0]}")
+        return False, time.monotonic() - started
+
+
+# Name of the step whose code is running, for StepOutput; PipelineContext
+# carries it into coroutines the step runs on the shared event loop
+current_step: contextvars.ContextVar[str | None] = contextvars.ContextVar('current_step', default=None)
+
+
+class StepOutput:
+    """Stand-in for sys.stdout/sys.stderr while steps run in-process.
+
+    Text written by a step's code comes out line by line as "[step] line",
+    like the streamed output of subprocess steps; anything else is written
+    straight through.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._partial: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        name = current_step.get()
+        if name is None:
+            return self.stream.write(text)
+
+        with self._lock:
+            *lines, rest = (self._partial.get(name, '') + text).split('\n')
+            # Progress bars redraw with \r; keep only the latest state of the line
+            self._partial[name] = rest[rest.rstrip('\r').rfind('\r') + 1:]
+            self._emit(name, lines)
+        return len(text)
+
+    def finish(self, name: str):
+        """Write out a step's unterminated last line."""
+        with self._lock:
+            self._emit(name, [self._partial.pop(name, '')])
+
+    def _emit(self, name: str, lines: list[str]):
+        for raw in lines:
+            line = raw.rstrip('\r').split('\r')[-1]
+            if line.strip():
+                self.stream.write(f"[{name}] {line}\n")
+        self.stream.flush()
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+
+def _execute_in_process(step: Step, ctx: PipelineContext, prefix: bool) -> tuple[bool, float]:
+    """Call a step script's main(argv, ctx) in this process. Returns (succeeded, seconds).
+
+    With prefix, the step's output is tagged by the StepOutput streams
+    run_dag installs.
+    """
+    started = time.monotonic()
+    token = current_step.set(step.name) if prefix else None
+    try:
+        module = importlib.import_module(Path(step.cmd[1]).stem)
+        code = module.main(step.cmd[2:], ctx)
+    except SystemExit as e:
+        code = e.code
+    except Exception as e:
+        print(f"❌ {step.name}: {type(e).__name__}: {e}")
+        code = 1
+    finally:
+        if prefix:
+            current_step.reset(token)
+            for stream in (sys.stdout, sys.stderr):
+                if isinstance(stream, StepOutput):
+                    stream.finish(step.name)
+    return not code, time.monotonic() - started
+
+
+def critical_path(steps: list[Step], seconds: dict[str, float]) -> tuple[list[str], float]:
+    """Chain of dependent steps with the largest total run time.
+
+    Only steps in `seconds` (those that ran) are on the path; skipped and
+    unchanged steps are left out, though chains through them still count.
+    """
+    by_name = {step.name: step for step in steps}
+    longest: dict[str, tuple[float, list[str]]] = {}
+
+    def visit(name: str) -> tuple[float, list[str]]:
+        if name not in longest:
+            deps = [visit(d) for d in by_name[name].deps if d in by_name]
+            total, path = max(deps, default=(0.0, []))
+            if name in seconds:
+                total, path = total + seconds[name], path + [name]
+            longest[name] = (total, path)
+        return longest[name]
+
+    return max((visit(step.name) for step in steps), default=(0.0, []))[::-1]
+
+
+def run_dag(
+    steps: list[Step],
+    db_path: str,
+    workers: int = 1,
+    force: bool = False,
+    ctx: PipelineContext | None = None,
+) -> bool:
+    """Run steps in dependency order, up to `workers` at a time. Returns True if none failed.
+
+    Steps run as subprocesses, or in-process against ctx if one is given.
+    """
+    names = {step.name for step in steps}
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    ensure_state_table(conn)
+    stored = dict(conn.execute("SELECT name, fingerprint FROM pipeline_steps"))
+
+    pending = {step.name: step for step in steps}
+    status: dict[str, str] = {}
+    seconds: dict[str, float] = {}
+    prefix = workers > 1
+    if ctx:
+        # In-process steps share this process's environment
+        keep_wal = os.environ.get(KEEP_WAL_ENV)
+        os.environ[KEEP_WAL_ENV] = "1"
+        if prefix:
+            streams = sys.stdout, sys.stderr
+            sys.stdout, sys.stderr = StepOutput(sys.stdout), StepOutput(sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while pending or running:
+            # Settle every step whose dependencies are done; skips can cascade
+            progressed = True
+            while progressed:
+                progressed = False
+                for name, step in list(pending.items()):
+                    deps = [d for d in step.deps if d in names]
+                    if any(d not in status for d in deps):
+                        continue
+                    del pending[name]
+                    progressed = True
+
+                    if not step.enabled:
+                        status[name] = 'skipped'
+                        print(f"⏭️  Skipping: {name}")
+                    elif any(status[d] in ('failed', 'blocked') for d in deps):
+                        status[name] = 'blocked'
+                        print(f"⏭️  Not running {name}: a step it depends on failed")
+                    elif (not force and stored.get(name) == step_fingerprint(conn, step)
+                          and not has_pending_work(conn, step)):
+                        status[name] = 'unchanged'
+                        print(f"⏭️  Unchanged since last run: {name}")
+                    else:
+                        print(f"\n{'='*60}")
+                        print(f"🚀 Running: {name}")
+                        print(f"{'='*60}\n")
+                        if ctx:
+                            running[pool.submit(_execute_in_process, step, ctx, prefix)] = step
+                        else:
+                            running[pool.submit(_execute, step, prefix)] = step
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Dependency cycle among steps: {', '.join(pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                ok, elapsed = future.result()
+                seconds[step.name] = elapsed
+                if ok:
+                    status[step.name] = 'done'
+                    conn.execute("""
+                        INSERT OR REPLACE INTO pipeline_steps (name, fingerprint, seconds, finished_at)
+                        VALUES (?, ?, ?, ?)
+                    """, (step.name, step_fingerprint(conn, step), elapsed, int(time.time())))
+                    conn.commit()
+                    print(f"\n✅ {step.name} completed successfully ({elapsed:.1f}s)")
+                else:
+                    status[step.name] = 'failed'
+                    print(f"\n❌ {step.name} failed ({elapsed:.1f}s)")
+
+    if ctx:
+        if prefix:
+            sys.stdout, sys.stderr = streams
+        # Pooled connections must be closed before the journal mode can change
+        ctx.release_connections()
+        if keep_wal is None:
+            del os.environ[KEEP_WAL_ENV]
+        else:
+            os.environ[KEEP_WAL_ENV] = keep_wal
+
+    leave_wal(conn)
+    conn.close()
+
+    path, total = critical_path(steps, seconds)
+    if path:
+        chain = " → ".join(f"{name} ({seconds[name]:.1f}s)" for name in path)
+        print(f"\n⏱️  Critical path ({total:.1f}s): {chain}")
+
+    return not any(s in ('failed', 'blocked') for s in status.values())
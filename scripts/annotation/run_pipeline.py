@@ -2,44 +2,34 @@
 """
 Phage Annotation Pipeline Orchestrator
 
-Runs all annotation steps in sequence:
-1. Protein domain annotation (InterProScan)
-2. AMG detection (KEGG mapping)
-3. Host tRNA data loading
-4. Codon adaptation calculation
+Runs the annotation steps as a dependency graph (see pipeline_dag.py),
+with independent steps in parallel:
+1. Host tRNA data loading (and optional GtRNAdb import)
+2. Protein domain annotation (InterProScan)
+3. AMG detection (KEGG mapping) - after domains
+4. Codon count matrices
+5. Codon adaptation, adaptation profiles and host ranking - after 1 and 4
+
+Steps whose inputs are unchanged since their last successful run are
+skipped unless --force is given or they left work pending (genes past
+--limit, failed genes or KEGG lookups still to be retried). With --in-process, steps run in this
+process against one shared PipelineContext instead of as subprocesses.
 
 Usage:
-    python run_pipeline.py --db phage.db [--skip-domains] [--skip-kegg]
+    python run_pipeline.py --db phage.db [--workers 2] [--force] [--in-process]
+        [--skip-domains] [--skip-kegg] [--skip-codon]
 """
 
 import argparse
 import sqlite3
-import subprocess
 import sys
 import time
 from pathlib import Path
 
-
-def run_step(name: str, cmd: list[str], skip: bool = False):
-    """Run a pipeline step."""
-    if skip:
-        print(f"⏭️  Skipping: {name}")
-        return True
-
-    print(f"\n{'='*60}")
-    print(f"🚀 Running: {name}")
-    print(f"{'='*60}\n")
-
-    try:
-        result = subprocess.run(cmd, check=True)
-        print(f"\n✅ {name} completed successfully")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"\n❌ {name} failed with exit code {e.returncode}")
-        return False
-    except FileNotFoundError:
-        print(f"\n❌ Command not found: {cmd[0]}")
-        return False
+from annotate_domains import PENDING_GENES_FILTER
+from fetch_kegg import AMG_WATERMARK_KEY
+from pipeline_context import PipelineContext
+from pipeline_dag import Step, run_dag
 
 
 def ensure_base_tables(db_path: str):
@@ -69,7 +59,8 @@ def ensure_base_tables(db_path: str):
             end INTEGER,
             score REAL,
             e_value REAL,
-            description TEXT
+            description TEXT,
+            interpro_id TEXT
         )
     """)
 
@@ -191,6 +182,16 @@ def main():
                        help="Skip InterProScan domain annotation (slow)")
     parser.add_argument("--skip-kegg", action="store_true",
                        help="Skip KEGG pathway mapping")
+    parser.add_argument("--skip-codon", action="store_true",
+                       help="Skip codon adaptation scoring")
+    parser.add_argument("--trna-dir",
+                       help="Directory of GtRNAdb / tRNAscan-SE files to import host tRNA pools from")
+    parser.add_argument("--workers", type=int, default=2,
+                       help="Number of steps allowed to run at the same time")
+    parser.add_argument("--force", action="store_true",
+                       help="Run every step even if its inputs are unchanged since its last run")
+    parser.add_argument("--in-process", action="store_true",
+                       help="Run steps in this process, sharing connections, genomes and HTTP sessions")
     parser.add_argument("--limit", type=int,
                        help="Limit number of genes to annotate (for testing)")
     args = parser.parse_args()
@@ -216,25 +217,61 @@ def main():
     print(f"   Existing domains: {initial_stats['domains']}")
     print(f"   Existing AMGs: {initial_stats['amgs']}")
 
-    success = True
     start_time = time.time()
 
-    # Step 1: Load host tRNA data (fast, always run)
-    cmd = [sys.executable, str(script_dir / "host_trna_data.py"), "--db", str(db_path)]
-    success = run_step("Host tRNA Data", cmd) and success
+    def script(name: str) -> list[str]:
+        return [sys.executable, str(script_dir / name), "--db", str(db_path)]
 
-    # Step 2: Domain annotation (slow - uses InterProScan REST API)
-    cmd = [sys.executable, str(script_dir / "annotate_domains.py"), "--db", str(db_path)]
+    trna_steps = ["host_trna"] + (["trna_import"] if args.trna_dir else [])
+    domains_cmd = script("annotate_domains.py")
     if args.limit:
-        cmd.extend(["--limit", str(args.limit)])
-    success = run_step("Domain Annotation (InterProScan)", cmd, skip=args.skip_domains) and success
+        domains_cmd.extend(["--limit", str(args.limit)])
+
+    # KEGG mapping only needs domains, so it also runs when annotation is
+    # skipped but earlier runs left domains behind
+    kegg_enabled = not args.skip_kegg and (not args.skip_domains or initial_stats['domains'] > 0)
+
+    # Work the incremental steps left for a later run
+    domains_pending = f"""
+        SELECT (SELECT COUNT(*) FROM genes g WHERE g.type = 'CDS' {PENDING_GENES_FILTER})
+             + (SELECT COUNT(*) FROM interpro_jobs WHERE status = 'RUNNING')
+    """
+    kegg_pending = f"""
+        SELECT (SELECT COALESCE(MAX(id), 0) FROM protein_domains)
+             > COALESCE((SELECT CAST(value AS INTEGER) FROM annotation_meta WHERE key = '{AMG_WATERMARK_KEY}'), 0)
+    """
+
+    steps = [
+        Step("host_trna", script("host_trna_data.py"),
+             outputs=["host_trna_pools", "host_trna_hosts", "host_codon_weights"]),
+        Step("trna_import", script("import_gtrnadb.py") + [args.trna_dir or ""], deps=["host_trna"],
+             outputs=["host_trna_pools", "host_trna_hosts", "host_codon_weights"],
+             files=[Path(args.trna_dir)] if args.trna_dir else [], enabled=bool(args.trna_dir)),
+        Step("domains", domains_cmd,
+             inputs=["genes", "sequences"], outputs=["protein_domains"], pending=domains_pending,
+             enabled=not args.skip_domains),
+        Step("kegg", script("fetch_kegg.py"), deps=["domains"],
+             inputs=["protein_domains"], outputs=["amg_annotations"], pending=kegg_pending,
+             enabled=kegg_enabled),
+        Step("codon_matrix", script("codon_matrix.py"),
+             inputs=["genes", "sequences"], outputs=["gene_codon_matrix"], enabled=not args.skip_codon),
+        Step("codon_adaptation", script("codon_adaptation.py"), deps=["codon_matrix"] + trna_steps,
+             inputs=["gene_codon_matrix", "host_codon_weights"], outputs=["codon_adaptation"],
+             enabled=not args.skip_codon),
+        Step("adaptation_profiles", script("adaptation_profiles.py"), deps=["codon_matrix"] + trna_steps,
+             inputs=["gene_codon_matrix", "host_codon_weights"], outputs=["adaptation_profiles"],
+             enabled=not args.skip_codon),
+        Step("host_ranking", script("host_ranking.py"), deps=["codon_matrix"] + trna_steps,
+             inputs=["gene_codon_matrix", "host_codon_weights"], outputs=["host_rankings"],
+             enabled=not args.skip_codon),
+    ]
 
-    # Step 3: KEGG AMG mapping (depends on domains)
-    if not args.skip_domains or initial_stats['domains'] > 0:
-        cmd = [sys.executable, str(script_dir / "fetch_kegg.py"), "--db", str(db_path)]
-        success = run_step("AMG Detection (KEGG)", cmd, skip=args.skip_kegg) and success
+    if args.in_process:
+        with PipelineContext(str(db_path)) as ctx:
+            success = run_dag(steps, str(db_path), workers=args.workers, force=args.force, ctx=ctx)
+            print(f"\n♻️  Shared context: {ctx.stats()}")
     else:
-        print("⏭️  Skipping AMG detection (no domains available)")
+        success = run_dag(steps, str(db_path), workers=args.workers, force=args.force)
 
     # Final stats
     elapsed = time.time() - start_time
@@ -247,6 +284,7 @@ def main():
     print(f"   Domains: {initial_stats['domains']} → {final_stats['domains']} (+{final_stats['domains'] - initial_stats['domains']})")
     print(f"   AMGs: {initial_stats['amgs']} → {final_stats['amgs']} (+{final_stats['amgs'] - initial_stats['amgs']})")
     print(f"   Host tRNAs: {final_stats['host_trnas']}")
+    print(f"   Codon adaptation scores: {final_stats['adaptations']}")
 
     if success:
         print("\n✅ All steps completed successfully!")
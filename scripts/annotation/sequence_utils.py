@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Vectorized Sequence Utilities
+
+Batch reverse-complement and translation of CDSs over a whole genome.
+Each genome is encoded once as base indices; the codon starting at every
+position on both strands is computed with NumPy, so translating a gene is
+a strided slice instead of a per-codon dict lookup.
+
+Codons are indexed 0-63 in TCAG order (TTT=0, TTC=1, ..., GGG=63); any
+codon containing a base other than A/C/G/T gets index 64 and translates
+to 'X'.
+"""
+
+import numpy as np
+
+BASES = "TCAG"
+CODONS = [a + b + c for a in BASES for b in BASES for c in BASES]
+GENETIC_CODE = "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"
+AMBIGUOUS_CODON = 64
+
+# Byte-level complement table; only uppercase A/C/G/T complement, all else -> N
+_COMPLEMENT = bytes(
+    {ord('A'): ord('T'), ord('T'): ord('A'), ord('C'): ord('G'), ord('G'): ord('C')}.get(i, ord('N'))
+    for i in range(256)
+)
+
+# Byte -> base index (0-3 in TCAG order, 4 for anything else)
+_BASE_INDEX = np.full(256, 4, dtype=np.uint8)
+for _i, _base in enumerate(BASES):
+    _BASE_INDEX[ord(_base)] = _i
+
+# Codon index -> amino acid byte, with 'X' for ambiguous codons
+_AA_LOOKUP = np.frombuffer((GENETIC_CODE + "X").encode('ascii'), dtype=np.uint8)
+
+
+def reverse_complement(seq: str) -> str:
+    """Reverse complement a DNA sequence (non-ACGT bases become N)."""
+    return seq.encode('ascii', errors='replace').translate(_COMPLEMENT)[::-1].decode('ascii')
+
+
+def encode_bases(seq: bytes) -> np.ndarray:
+    """Map raw sequence bytes to base indices (uppercase ACGT only)."""
+    return _BASE_INDEX[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def codon_indices(bases: np.ndarray) -> np.ndarray:
+    """Index of the codon starting at every position of an encoded sequence."""
+    if len(bases) < 3:
+        return np.empty(0, dtype=np.int16)
+
+    first, second, third = bases[:-2], bases[1:-1], bases[2:]
+    idx = first.astype(np.int16) * 16 + second * 4 + third
+    # Base index 4 is the only value with bit 2 set
+    idx[(first | second | third) > 3] = AMBIGUOUS_CODON
+    return idx
+
+
+def _translate_positions(seq: bytes) -> bytes:
+    """Amino acid of the codon starting at every position of seq."""
+    return _AA_LOOKUP[codon_indices(encode_bases(seq))].tobytes()
+
+
+def _stop_at_first_stop(protein: bytes) -> str:
+    return protein.split(b'*', 1)[0].decode('ascii')
+
+
+def translate_sequence(seq: str, frame: int = 0) -> str:
+    """Translate DNA to protein sequence, stopping at the first stop codon."""
+    raw = seq.encode('ascii', errors='replace').upper()[frame:]
+    return _stop_at_first_stop(_translate_positions(raw)[::3])
+
+
+def translate_genes(genome: str, genes: list[tuple[int, int, str]]) -> list[str]:
+    """Translate many CDSs of one genome at once.
+
+    genes holds (start_pos, end_pos, strand) with 1-based inclusive
+    coordinates, as stored in the genes table. The result for each gene is
+    identical to translate_sequence() on its (reverse-complemented) DNA.
+    """
+    raw = genome.encode('ascii', errors='replace')
+    length = len(raw)
+
+    forward = _translate_positions(raw.upper())
+    reverse = None
+
+    proteins = []
+    for start_pos, end_pos, strand in genes:
+        start, end, _ = slice(start_pos - 1, end_pos).indices(length)
+        if end - start < 3:
+            proteins.append('')
+            continue
+
+        if strand == '-':
+            if reverse is None:
+                reverse = _translate_positions(raw.translate(_COMPLEMENT)[::-1])
+            # Position i on the reverse strand is genome position length - 1 - i
+            start, end = length - end, length - start
+            protein = reverse[start:end - 2:3]
+        else:
+            protein = forward[start:end - 2:3]
+
+        proteins.append(_stop_at_first_stop(protein))
+
+    return proteins
+
+
+def gene_codons(genome: str, genes: list[tuple[int, int, str]]) -> list[np.ndarray]:
+    """In-frame codon indices of many CDSs of one genome.
+
+    Takes the same (start_pos, end_pos, strand) tuples as translate_genes().
+    Each gene's array runs 5' to 3' on its own strand, includes the stop
+    codon, and uses AMBIGUOUS_CODON for codons with non-ACGT bases.
+    """
+    raw = genome.encode('ascii', errors='replace').upper()
+    length = len(raw)
+
+    forward = codon_indices(encode_bases(raw))
+    reverse = None
+
+    codons = []
+    for start_pos, end_pos, strand in genes:
+        start, end, _ = slice(start_pos - 1, end_pos).indices(length)
+        if end - start < 3:
+            codons.append(np.empty(0, dtype=np.int16))
+            continue
+
+        if strand == '-':
+            if reverse is None:
+                reverse = codon_indices(encode_bases(raw.translate(_COMPLEMENT)[::-1]))
+            start, end = length - end, length - start
+            codons.append(reverse[start:end - 2:3])
+        else:
+            codons.append(forward[start:end - 2:3])
+
+    return codons
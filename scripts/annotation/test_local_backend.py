@@ -0,0 +1,139 @@
+"""
+Tests for annotate_domains.py with the local backend, using a stub script
+in place of interproscan.sh.
+
+Run from scripts/annotation:
+    python -m pytest -q
+"""
+
+import json
+import sqlite3
+import sys
+
+import pytest
+
+import annotate_domains
+
+# Sense codons only, so the ORFs below have no internal stops
+SENSE_CODONS = ["GCT", "CGT", "AAC", "GAT", "TGT", "CAA", "GGT", "CAT", "ATT", "CTG", "AAA", "TTT", "CCG", "TCT"]
+
+STUB = """#!{python}
+import json, os, sys
+
+args = sys.argv[1:]
+if '--version' in args:
+    print("InterProScan version 5.99-1.0")
+    sys.exit(0)
+opts = dict(zip(args[::2], args[1::2]))
+
+proteins = []
+for line in open(opts['-i']):
+    line = line.strip()
+    if line.startswith('>'):
+        proteins.append([line[1:], ''])
+    elif line:
+        proteins[-1][1] += line
+
+with open(os.environ['STUB_LOG'], 'a') as log:
+    log.write(json.dumps([seq for _, seq in proteins]) + "\\n")
+
+results = [{{
+    "sequence": seq,
+    "xref": [{{"id": name, "name": name}}],
+    "matches": [{{
+        "signature": {{
+            "accession": "PF00001", "name": "dom", "description": "Domain one",
+            "signatureLibraryRelease": {{"library": "PFAM", "version": "36"}}, "entry": None,
+        }},
+        "locations": [{{"start": 1, "end": 20, "score": 5.0, "evalue": 1e-5}}],
+    }}],
+}} for name, seq in proteins]
+json.dump({{"interproscan-version": "5.99-1.0", "results": results}}, open(opts['-o'], 'w'))
+"""
+
+
+def orf(offset: int, codons: int = 40) -> str:
+    return "ATG" + "".join(SENSE_CODONS[(offset + i * 5) % len(SENSE_CODONS)] for i in range(codons)) + "TAA"
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """A phage.db with three CDSs (two encoding the same protein) and a stub interproscan.sh."""
+    duplicated, unique = orf(0), orf(3)
+    spacer = "CCCCCCCCCC"
+    genome = duplicated + spacer + duplicated + spacer + unique
+
+    db_path = tmp_path / "phage.db"
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE phages (id INTEGER PRIMARY KEY, accession TEXT, name TEXT);
+        CREATE TABLE sequences (phage_id INTEGER, chunk_index INTEGER, sequence TEXT);
+        CREATE TABLE genes (
+            id INTEGER PRIMARY KEY, phage_id INTEGER, locus_tag TEXT, name TEXT,
+            start_pos INTEGER, end_pos INTEGER, strand TEXT, product TEXT, type TEXT
+        );
+    """)
+    conn.execute("INSERT INTO phages VALUES (1, 'NC_000001', 'Test phage')")
+    conn.execute("INSERT INTO sequences VALUES (1, 0, ?)", (genome,))
+    start = 1
+    for gene_id, seq in enumerate([duplicated, duplicated, unique], start=1):
+        conn.execute(
+            "INSERT INTO genes VALUES (?, 1, ?, NULL, ?, ?, '+', NULL, 'CDS')",
+            (gene_id, f"T_{gene_id}", start, start + len(seq) - 1),
+        )
+        start += len(seq) + len(spacer)
+    conn.commit()
+    conn.close()
+
+    stub = tmp_path / "interproscan.sh"
+    stub.write_text(STUB.format(python=sys.executable))
+    stub.chmod(0o755)
+    log = tmp_path / "stub.log"
+    monkeypatch.setenv("STUB_LOG", str(log))
+
+    argv = ["--db", str(db_path), "--backend", "local", "--interproscan", str(stub),
+            "--cache-dir", str(tmp_path / "cache")]
+    return db_path, argv, log
+
+
+def stub_runs(log) -> list[list[str]]:
+    """Proteins passed to each stub invocation."""
+    return [json.loads(line) for line in log.read_text().splitlines()] if log.exists() else []
+
+
+def domain_rows(db_path) -> list[tuple]:
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT gene_id, domain_id, start, end FROM protein_domains ORDER BY gene_id").fetchall()
+    conn.close()
+    return rows
+
+
+def test_identical_proteins_are_run_once(workspace):
+    db_path, argv, log = workspace
+    assert annotate_domains.main(argv) == 0
+
+    runs = stub_runs(log)
+    assert len(runs) == 1
+    assert len(runs[0]) == 2
+    assert [row[0] for row in domain_rows(db_path)] == [1, 2, 3]
+
+
+def test_cached_results_skip_interproscan(workspace):
+    db_path, argv, log = workspace
+    annotate_domains.main(argv)
+    first = domain_rows(db_path)
+
+    # --force re-annotates every gene, but all proteins are in the cache
+    assert annotate_domains.main(argv + ["--force"]) == 0
+    assert len(stub_runs(log)) == 1
+    assert domain_rows(db_path) == first
+
+
+def test_rerun_is_a_noop(workspace):
+    db_path, argv, log = workspace
+    annotate_domains.main(argv)
+    first = domain_rows(db_path)
+
+    assert annotate_domains.main(argv) == 0
+    assert len(stub_runs(log)) == 1
+    assert domain_rows(db_path) == first